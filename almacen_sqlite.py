@@ -0,0 +1,251 @@
+"""
+Almacenamiento local de StudentData en SQLite
+Alternativa a Firebase Realtime Database para desarrollo, pruebas de carga
+y despliegues sin conexión (STUDENT_BACKEND=sqlite). El perfil se guarda
+como JSON, el progreso en una fila por (usuario, tema) y el historial de
+evaluaciones en una fila por evaluación
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from firebase_config import StudentBackend, apply_updates, is_increment
+
+RUTA_ESTUDIANTES = os.getenv('STUDENT_SQLITE_PATH', 'estudiantes.db')
+
+# Campos del progreso de un tema que tienen columna propia
+_COLUMNAS_PROGRESO = ("ejercicios_completados", "videos_vistos", "ultimo_acceso")
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS estudiantes (
+    user_id TEXT PRIMARY KEY,
+    datos TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progreso (
+    user_id TEXT NOT NULL,
+    tema TEXT NOT NULL,
+    ejercicios_completados INTEGER,
+    videos_vistos INTEGER,
+    ultimo_acceso TEXT,
+    otros TEXT,
+    PRIMARY KEY (user_id, tema)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_progreso_tema ON progreso (tema);
+CREATE TABLE IF NOT EXISTS historial (
+    user_id TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    PRIMARY KEY (user_id, clave)
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteBackend(StudentBackend):
+    def __init__(self, ruta: Optional[str] = None):
+        """Inicializa el almacenamiento sobre un archivo SQLite"""
+        self.ruta = ruta or RUTA_ESTUDIANTES
+        self._lock = threading.Lock()
+        self._inicializado = False
+
+    @contextmanager
+    def _conexion(self, escritura: bool = False):
+        """Abre una conexión por operación; las escrituras toman el bloqueo al empezar"""
+        conn = sqlite3.connect(self.ruta, timeout=10)
+        try:
+            if not self._inicializado:
+                with self._lock:
+                    if not self._inicializado:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(_ESQUEMA)
+                        self._inicializado = True
+            if escritura:
+                # Lectura y escritura en la misma transacción (leer-modificar-escribir)
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ---------------------- Estudiantes ------------------------
+
+    def get_student(self, user_id):
+        with self._conexion() as conn:
+            return self._leer(conn, user_id)
+
+    def get_student_field(self, user_id, path):
+        claves = [k for k in path.split('/') if k]
+        with self._conexion() as conn:
+            if claves and claves[0] == "progreso":
+                # El progreso de un tema se lee sin cargar el perfil
+                progreso = self._leer_progreso(conn, user_id, claves[1] if len(claves) > 1 else None)
+                valor = progreso if progreso else None
+                claves = claves[1:]
+            else:
+                valor = self._leer_datos(conn, user_id)
+            for clave in claves:
+                if not isinstance(valor, dict) or clave not in valor:
+                    return None
+                valor = valor[clave]
+            return valor
+
+    def set_student(self, user_id, data):
+        with self._conexion(escritura=True) as conn:
+            self._escribir(conn, user_id, data)
+
+    def update_students(self, updates_by_user):
+        with self._conexion(escritura=True) as conn:
+            for user_id, updates in updates_by_user.items():
+                columnas = {}
+                documento = {}
+                for path, value in updates.items():
+                    claves = [k for k in path.split('/') if k]
+                    if len(claves) == 3 and claves[0] == "progreso" and claves[2] in _COLUMNAS_PROGRESO:
+                        columnas[path] = (claves[1], claves[2], value)
+                    else:
+                        documento[path] = value
+
+                for tema, columna, value in columnas.values():
+                    self._actualizar_columna(conn, user_id, tema, columna, value)
+
+                if documento:
+                    # Cualquier otra ruta: se aplica sobre el documento completo
+                    data = self._leer(conn, user_id) or {}
+                    self._escribir(conn, user_id, apply_updates(data, documento))
+
+    # ---------------------- Historial ------------------------
+
+    def append_evaluations(self, entries_by_user):
+        filas = [
+            (user_id, clave, json.dumps(evaluacion, ensure_ascii=False))
+            for user_id, entries in entries_by_user.items()
+            for clave, evaluacion in entries.items()
+        ]
+        with self._conexion(escritura=True) as conn:
+            conn.executemany("INSERT OR REPLACE INTO historial (user_id, clave, datos) VALUES (?, ?, ?)", filas)
+
+    def get_evaluations(self, user_id, limit, before=None) -> List[Tuple[str, Dict[str, Any]]]:
+        consulta = "SELECT clave, datos FROM historial WHERE user_id = ?"
+        parametros = [user_id]
+        if before:
+            consulta += " AND clave < ?"
+            parametros.append(before)
+        consulta += " ORDER BY clave DESC LIMIT ?"
+        parametros.append(limit)
+        with self._conexion() as conn:
+            filas = conn.execute(consulta, parametros).fetchall()
+        return [(clave, json.loads(datos)) for clave, datos in reversed(filas)]
+
+    def get_evaluation_keys(self, user_id):
+        with self._conexion() as conn:
+            filas = conn.execute(
+                "SELECT clave FROM historial WHERE user_id = ? ORDER BY clave", (user_id,)
+            ).fetchall()
+        return [clave for (clave,) in filas]
+
+    def delete_evaluations(self, user_id, keys):
+        if not keys:
+            return
+        with self._conexion(escritura=True) as conn:
+            conn.executemany(
+                "DELETE FROM historial WHERE user_id = ? AND clave = ?",
+                [(user_id, clave) for clave in keys]
+            )
+
+    def move_legacy_history(self, user_id, entries_by_key):
+        with self._conexion(escritura=True) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO historial (user_id, clave, datos) VALUES (?, ?, ?)",
+                [(user_id, clave, json.dumps(e, ensure_ascii=False)) for clave, e in entries_by_key.items()]
+            )
+            datos = self._leer_datos(conn, user_id)
+            if datos is not None and "historial_evaluaciones" in datos:
+                del datos["historial_evaluaciones"]
+                self._escribir_datos(conn, user_id, datos)
+
+    # ---------------------- Auxiliares ------------------------
+
+    def _leer(self, conn, user_id) -> Optional[Dict[str, Any]]:
+        datos = self._leer_datos(conn, user_id)
+        progreso = self._leer_progreso(conn, user_id)
+        if datos is None and not progreso:
+            return None
+        datos = datos or {}
+        if progreso:
+            datos["progreso"] = progreso
+        return datos
+
+    def _leer_datos(self, conn, user_id) -> Optional[Dict[str, Any]]:
+        fila = conn.execute("SELECT datos FROM estudiantes WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def _leer_progreso(self, conn, user_id, tema=None) -> Dict[str, Any]:
+        consulta = ("SELECT tema, ejercicios_completados, videos_vistos, ultimo_acceso, otros "
+                    "FROM progreso WHERE user_id = ?")
+        parametros = [user_id]
+        if tema is not None:
+            consulta += " AND tema = ?"
+            parametros.append(tema)
+
+        progreso = {}
+        for tema, completados, vistos, acceso, otros in conn.execute(consulta, parametros):
+            valor = json.loads(otros) if otros else {}
+            if completados is not None:
+                valor["ejercicios_completados"] = completados
+            if vistos is not None:
+                valor["videos_vistos"] = vistos
+            if acceso is not None:
+                valor["ultimo_acceso"] = json.loads(acceso)
+            if valor:
+                progreso[tema] = valor
+        return progreso
+
+    def _escribir(self, conn, user_id, data):
+        datos = dict(data)
+        progreso = datos.pop("progreso", None) or {}
+        self._escribir_datos(conn, user_id, datos)
+
+        conn.execute("DELETE FROM progreso WHERE user_id = ?", (user_id,))
+        filas = []
+        for tema, valor in progreso.items():
+            if not isinstance(valor, dict):
+                continue
+            otros = {k: v for k, v in valor.items() if k not in _COLUMNAS_PROGRESO}
+            acceso = valor.get("ultimo_acceso")
+            filas.append((
+                user_id, tema,
+                valor.get("ejercicios_completados"),
+                valor.get("videos_vistos"),
+                None if acceso is None else json.dumps(acceso, ensure_ascii=False),
+                json.dumps(otros, ensure_ascii=False) if otros else None
+            ))
+        conn.executemany(
+            "INSERT INTO progreso (user_id, tema, ejercicios_completados, videos_vistos, ultimo_acceso, otros) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            filas
+        )
+
+    def _escribir_datos(self, conn, user_id, datos):
+        conn.execute(
+            "INSERT OR REPLACE INTO estudiantes (user_id, datos) VALUES (?, ?)",
+            (user_id, json.dumps(datos, ensure_ascii=False))
+        )
+
+    def _actualizar_columna(self, conn, user_id, tema, columna, value):
+        conn.execute("INSERT OR IGNORE INTO progreso (user_id, tema) VALUES (?, ?)", (user_id, tema))
+        # `columna` sale de _COLUMNAS_PROGRESO, no de la entrada del usuario
+        if is_increment(value):
+            conn.execute(
+                f"UPDATE progreso SET {columna} = COALESCE({columna}, 0) + ? WHERE user_id = ? AND tema = ?",
+                (value[".sv"]["increment"], user_id, tema)
+            )
+            return
+        if columna == "ultimo_acceso" and value is not None:
+            value = json.dumps(value, ensure_ascii=False)
+        conn.execute(
+            f"UPDATE progreso SET {columna} = ? WHERE user_id = ? AND tema = ?",
+            (value, user_id, tema)
+        )
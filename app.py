@@ -1,9 +1,16 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
 from busquedas import buscar_videos_youtube
+from catalogo_videos import obtener_videos_catalogo
 from temas import temas
-from ejercicios import generar_ejercicio_aleatorio
+from ejercicios import generar_ejercicios, como_pregunta, temas_disponibles
 from firebase_config import FirebaseAuth, StudentData
-from gemini_service import GeminiService
+from gemini_service import obtener_servicio_gemini
+from banco_preguntas import obtener_preguntas, obtener_preguntas_stream
+from precarga import PrecargadorCuestionarios
+from limitador import PRIORIDAD_GENERACION, PRIORIDAD_PRECARGA
+from cuestionarios import almacen_cuestionarios, vista_publica
+from escritura_diferida import buffer_progreso
+import os
 import random
 import json
 from datetime import datetime
@@ -11,11 +18,63 @@ from datetime import datetime
 app = Flask(__name__)
 app.secret_key = "clave_secreta_demo"
 
+def generar_cuestionario(tema, nivel_academico, cantidad=10, prioridad=PRIORIDAD_GENERACION):
+    """Obtiene un cuestionario desde el banco local o Gemini"""
+    return obtener_preguntas(obtener_servicio_gemini(), tema, nivel_academico, cantidad=cantidad, prioridad=prioridad)
+
+def precargar_cuestionario(tema, nivel_academico, cantidad=10):
+    """Generación en segundo plano: cede el turno a evaluaciones y generaciones"""
+    return generar_cuestionario(tema, nivel_academico, cantidad, prioridad=PRIORIDAD_PRECARGA)
+
+# Precarga en segundo plano del próximo cuestionario de cada estudiante
+precargador = PrecargadorCuestionarios(precargar_cuestionario)
+
+# Volcado periódico del progreso de los estudiantes a Firebase
+buffer_progreso.iniciar()
+
+def obtener_nivel_academico(user_id):
+    """Nivel académico del estudiante según su perfil (universidad por defecto)"""
+    result = StudentData.get_student_data(user_id)
+    if result["success"]:
+        return result["data"].get("nivel_academico", "universidad")
+    return "universidad"
+
 # Decorador para verificar autenticación
+# Verificar el ID token de Firebase en cada petición autenticada
+VERIFICAR_TOKENS = os.environ.get('AUTH_VERIFICAR_TOKENS', '1') == '1'
+
+def sesion_valida():
+    """Comprueba el ID token de la sesión y lo renueva si expiró"""
+    if not VERIFICAR_TOKENS:
+        return True
+    id_token = session.get('id_token')
+    if not id_token:
+        return False
+    
+    result = FirebaseAuth.verify_id_token(id_token)
+    if result["success"]:
+        return result["uid"] == session['user']
+    if result.get("unavailable"):
+        # Sin certificados (p. ej. sin red): se confía en la cookie firmada
+        return True
+    if not result.get("expired") or not session.get('refresh_token'):
+        return False
+    
+    renewed = FirebaseAuth.refresh_id_token(session['refresh_token'])
+    if not renewed["success"] or renewed["user"]["localId"] != session['user']:
+        return False
+    session['id_token'] = renewed["user"]["idToken"]
+    session['refresh_token'] = renewed["user"]["refreshToken"]
+    return True
+
 def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user' not in session:
             return redirect(url_for('login'))
+        if not sesion_valida():
+            session.clear()
+            flash("Tu sesión expiró. Inicia sesión de nuevo.")
+            return redirect(url_for('login'))
         return f(*args, **kwargs)
     decorated_function.__name__ = f.__name__
     return decorated_function
@@ -37,11 +96,11 @@ def login():
             user_id = result['user']['localId']
             session['user'] = user_id
             session['email'] = email
+            session['id_token'] = result['user']['idToken']
+            session['refresh_token'] = result['user']['refreshToken']
             
-            # Cargar datos del estudiante
-            student_data = StudentData.get_student_data(user_id)
-            if student_data["success"]:
-                session['student_data'] = student_data["data"]
+            # Precargar el perfil en la caché (ya no se copia a la cookie de sesión)
+            StudentData.get_student_data(user_id)
             
             flash("Inicio de sesión exitoso.")
             return redirect(url_for("index"))
@@ -120,20 +179,28 @@ def register():
 @login_required
 def perfil():
     user_id = session.get('user')
-    student_data = session.get('student_data')
     
-    if not student_data:
-        # Intentar cargar desde la base de datos
-        result = StudentData.get_student_data(user_id)
-        if result["success"]:
-            student_data = result["data"]
-            session['student_data'] = student_data
-        else:
-            flash("Error al cargar datos del perfil.")
-            return redirect(url_for("index"))
+    # Leer el perfil a través de la caché de StudentData
+    result = StudentData.get_student_data(user_id)
+    if result["success"]:
+        student_data = result["data"]
+    else:
+        flash("Error al cargar datos del perfil.")
+        return redirect(url_for("index"))
     
     return render_template("perfil.html", student_data=student_data)
 
+@app.route("/historial")
+@login_required
+def historial():
+    """Historial de evaluaciones paginado (?limite=20&antes=<id de la última evaluación recibida>)"""
+    user_id = session.get('user')
+    limite = min(max(request.args.get("limite", 20, type=int), 1), 100)
+    result = StudentData.get_evaluation_history(user_id, limit=limite, before=request.args.get("antes"))
+    if not result["success"]:
+        return jsonify({"success": False, "error": result["error"]})
+    return jsonify({"success": True, "evaluaciones": result["data"], "siguiente": result["next"]})
+
 @app.route("/logout")
 def logout():
     FirebaseAuth.logout_user()
@@ -145,17 +212,13 @@ def logout():
 def index():
     asignatura = "Estadística"
 
-    # Cargar nombre del estudiante desde la sesión o Firebase
+    # Cargar nombre del estudiante (caché de perfiles o Firebase)
     user_id = session.get("user")
-    student_data = session.get("student_data")
-
-    if not student_data:
-        result = StudentData.get_student_data(user_id)
-        if result["success"]:
-            student_data = result["data"]
-            session["student_data"] = student_data
-        else:
-            student_data = {"nombre": "Estudiante"}
+    result = StudentData.get_student_data(user_id)
+    if result["success"]:
+        student_data = result["data"]
+    else:
+        student_data = {"nombre": "Estudiante"}
 
     nombre_estudiante = student_data.get("nombre", "Estudiante")
 
@@ -188,9 +251,10 @@ def visual():
     nombre = request.args.get("nombre")
     tema = request.args.get("tema")
 
-    # Evitar errores si el tema llega vacío
-    if not tema:
-        tema = "Tema no especificado"
+    # Solo temas del catálogo: el tema forma parte de la ruta del progreso en Firebase
+    if tema not in temas["Estadística"]:
+        flash("El tema seleccionado no es válido. Selecciona uno de la lista.")
+        return redirect(url_for("index"))
 
     # Introducción dinámica
     introduccion = (
@@ -199,22 +263,26 @@ def visual():
         f"En esta sección aprenderás su aplicación práctica, ejemplos visuales y cómo interpretarlo."
     )
 
-    # Obtener videos aleatorios
-    videos = buscar_videos_youtube(f"{tema} Estadística", 6)
+    # Obtener videos aleatorios del catálogo local; buscar en vivo solo si
+    # el tema no está en el catálogo
+    videos = obtener_videos_catalogo(tema, 6)
+    if not videos:
+        videos = buscar_videos_youtube(f"{tema} Estadística", 6)
     random.shuffle(videos)
     videos = videos[:3]  # muestra 3 aleatorios
 
     # Registrar progreso del estudiante
     user_id = session.get('user')
     if user_id:
-        StudentData.update_student_progress(user_id, tema, ejercicio_completado=False)
+        buffer_progreso.registrar_progreso(user_id, tema, ejercicio_completado=False)
 
     return render_template(
         "visual.html",
         nombre=nombre,
         tema=tema,
         introduccion=introduccion,
-        videos=videos
+        videos=videos,
+        ejercicios_numericos=tema in temas_disponibles()
     )
 
 
@@ -230,20 +298,27 @@ def practico():
         flash("⚠️ Tema no especificado.")
         return redirect(url_for("index"))
 
+    # Solo temas del catálogo: el tema forma parte de la ruta del progreso en Firebase
+    if tema not in temas["Estadística"]:
+        flash("El tema seleccionado no es válido. Selecciona uno de la lista.")
+        return redirect(url_for("index"))
+
     # Guardar tema en sesión para generación asíncrona
     session['tema_actual'] = tema
     
     # Registrar progreso del estudiante
     user_id = session.get('user')
     if user_id:
-        StudentData.update_student_progress(user_id, tema, ejercicio_completado=False)
+        buffer_progreso.registrar_progreso(user_id, tema, ejercicio_completado=False)
 
     # Mostrar página inmediatamente con skeleton loading
     return render_template(
         "practico.html",
         nombre=nombre,
         tema=tema,
-        preguntas=[]  # Vacío inicialmente
+        preguntas=[],  # Vacío inicialmente
+        # ?modo=numerico: ejercicios generados localmente en lugar de Gemini
+        modo_numerico=request.args.get("modo") == "numerico"
     )
 
 @app.route("/generar_preguntas", methods=["POST"])
@@ -259,53 +334,148 @@ def generar_preguntas():
         
         # Obtener nivel académico del estudiante
         user_id = session.get('user')
-        student_data = session.get('student_data')
-        nivel_academico = "universidad"  # Default
+        nivel_academico = obtener_nivel_academico(user_id)
         
-        if student_data and 'nivel_academico' in student_data:
-            nivel_academico = student_data['nivel_academico']
+        # Usar el cuestionario precargado; si no hay, servir desde el banco
+        # local o generar con Gemini si no alcanza
+        preguntas = precargador.tomar(user_id, tema, nivel_academico, 10)
+        if preguntas is None:
+            preguntas = generar_cuestionario(tema, nivel_academico, cantidad=10)
         
-        # Generar preguntas con Gemini
-        gemini_service = GeminiService()
-        preguntas = gemini_service.generar_preguntas(tema, nivel_academico, cantidad=10)
+        # Ir preparando el siguiente cuestionario mientras el estudiante responde
+        precargador.programar_siguientes(user_id, tema, nivel_academico, 10)
         
-        # Guardar preguntas en la sesión
-        session['preguntas_actuales'] = preguntas
+        # Guardar el cuestionario en el servidor; el navegador recibe solo
+        # el id y las preguntas sin respuestas
+        quiz_id = almacen_cuestionarios.crear(user_id, tema, preguntas)
         
         return jsonify({
             "success": True,
-            "preguntas": preguntas
+            "quiz_id": quiz_id,
+            "preguntas": [vista_publica(p) for p in preguntas]
         })
         
     except Exception as e:
         print(f"Error generando preguntas: {e}")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route("/generar_ejercicios", methods=["POST"])
+@login_required
+def generar_ejercicios_numericos():
+    """Cuestionario de ejercicios numéricos generados localmente (sin Gemini)"""
+    try:
+        data = request.get_json()
+        tema = data.get('tema')
+        
+        if not tema:
+            return jsonify({"success": False, "error": "Tema no especificado"})
+        
+        cantidad = min(max(int(data.get('cantidad', 10)), 1), 20)
+        # Por defecto el estudiante escribe el resultado; {"opciones": true} da opción múltiple
+        opciones = bool(data.get('opciones', False))
+        preguntas = [
+            como_pregunta(ejercicio, i, opciones=opciones)
+            for i, ejercicio in enumerate(generar_ejercicios(tema, cantidad), start=1)
+        ]
+        
+        # Igual que los cuestionarios de Gemini: las respuestas quedan en el servidor
+        quiz_id = almacen_cuestionarios.crear(session.get('user'), tema, preguntas)
+        
+        return jsonify({
+            "success": True,
+            "quiz_id": quiz_id,
+            "preguntas": [vista_publica(p) for p in preguntas]
+        })
+        
+    except Exception as e:
+        print(f"Error generando ejercicios: {e}")
+        return jsonify({"success": False, "error": str(e)})
+
+def _evento_sse(evento, datos):
+    """Formatea un evento Server-Sent Events"""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+@app.route("/generar_preguntas_stream")
+@login_required
+def generar_preguntas_stream():
+    """Enviar las preguntas una a una (Server-Sent Events) a medida que se generan"""
+    tema = request.args.get('tema')
+    
+    if not tema:
+        return jsonify({"success": False, "error": "Tema no especificado"}), 400
+    
+    # Obtener nivel académico del estudiante
+    user_id = session.get('user')
+    nivel_academico = obtener_nivel_academico(user_id)
+    
+    def eventos():
+        try:
+            preguntas = precargador.tomar(user_id, tema, nivel_academico, 10)
+            if preguntas is None:
+                preguntas = obtener_preguntas_stream(obtener_servicio_gemini(), tema, nivel_academico, cantidad=10)
+            
+            quiz_id = almacen_cuestionarios.crear(user_id, tema)
+            yield _evento_sse("inicio", {"quiz_id": quiz_id})
+            
+            total = 0
+            for pregunta in preguntas:
+                total += 1
+                almacen_cuestionarios.agregar_pregunta(quiz_id, pregunta)
+                yield _evento_sse("pregunta", vista_publica(pregunta))
+            
+            yield _evento_sse("fin", {"total": total})
+            precargador.programar_siguientes(user_id, tema, nivel_academico, 10)
+        except Exception as e:
+            print(f"Error generando preguntas en streaming: {e}")
+            yield _evento_sse("error", {"error": str(e)})
+    
+    return Response(
+        stream_with_context(eventos()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/evaluar_respuestas", methods=["POST"])
 @login_required
 def evaluar_respuestas():
     """Evaluar respuestas usando Gemini"""
     try:
         data = request.get_json()
-        tema = data.get('tema')
-        preguntas = data.get('preguntas')
+        quiz_id = data.get('quiz_id')
         respuestas_usuario = data.get('respuestas')
         
-        if not all([tema, preguntas, respuestas_usuario]):
+        if not all([quiz_id, respuestas_usuario]):
             return jsonify({"success": False, "error": "Datos incompletos"})
         
+        # Las preguntas y respuestas correctas se toman del servidor; el
+        # cuestionario se retira para que no pueda evaluarse dos veces
+        cuestionario = almacen_cuestionarios.tomar(quiz_id, session.get('user'))
+        if cuestionario is None:
+            return jsonify({"success": False, "error": "El cuestionario no existe, expiró o ya fue evaluado. Genera uno nuevo."}), 404
+        
+        tema = cuestionario['tema']
+        preguntas = cuestionario['preguntas']
+        if not preguntas:
+            almacen_cuestionarios.devolver(quiz_id, cuestionario)
+            return jsonify({"success": False, "error": "El cuestionario no tiene preguntas"}), 400
+        
         # Evaluar respuestas con Gemini
-        gemini_service = GeminiService()
+        gemini_service = obtener_servicio_gemini()
         respuestas_evaluadas = []
         puntaje_total = 0
         
-        for pregunta in preguntas:
+        try:
+            # Las respuestas abiertas se evalúan en paralelo; el orden se conserva
+            evaluaciones = gemini_service.evaluar_cuestionario(preguntas, respuestas_usuario)
+        except Exception:
+            # Si la evaluación falla, el estudiante puede volver a enviarlo
+            almacen_cuestionarios.devolver(quiz_id, cuestionario)
+            raise
+        
+        for pregunta, evaluacion in zip(preguntas, evaluaciones):
             pregunta_id = pregunta['id']
             respuesta_usuario = respuestas_usuario.get(str(pregunta_id), '')
             
-            # Evaluar respuesta
-            evaluacion = gemini_service.evaluar_respuesta(pregunta, respuesta_usuario)
-            
             resultado = {
                 "pregunta_id": pregunta_id,
                 "respuesta_usuario": respuesta_usuario,
@@ -322,7 +492,7 @@ def evaluar_respuestas():
         
         # Guardar progreso en Firebase
         user_id = session.get('user')
-        if user_id:
+        if user_id and tema in temas["Estadística"]:
             progreso = {
                 "tema": tema,
                 "puntaje": puntaje_final,
@@ -331,13 +501,9 @@ def evaluar_respuestas():
                 "respuestas_correctas": sum(1 for r in respuestas_evaluadas if r["correcta"])
             }
             
-            # Actualizar progreso del estudiante
-            StudentData.update_student_progress(user_id, tema, ejercicio_completado=True)
-            
-            # Guardar historial de evaluaciones
-            historial_result = StudentData.save_evaluation_history(user_id, progreso)
-            if not historial_result["success"]:
-                print(f"Error guardando historial: {historial_result['error']}")
+            # Actualizar progreso e historial (se escriben en el siguiente volcado)
+            buffer_progreso.registrar_progreso(user_id, tema, ejercicio_completado=True)
+            buffer_progreso.registrar_evaluacion(user_id, progreso)
         
         return jsonify({
             "success": True,
@@ -350,6 +516,12 @@ def evaluar_respuestas():
         print(f"Error evaluando respuestas: {e}")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route("/estado_gemini")
+@login_required
+def estado_gemini():
+    """Ocupación del limitador de Gemini (cola y tiempos de espera) y estado del circuito"""
+    return jsonify(obtener_servicio_gemini().estado())
+
 
 
 if __name__ == "__main__":
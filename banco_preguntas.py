@@ -0,0 +1,266 @@
+"""
+Banco local de preguntas generadas
+Guarda en SQLite las preguntas validadas de Gemini, indexadas por tema,
+nivel académico y tipo, y sirve cuestionarios aleatorios desde el disco
+"""
+
+import os
+import json
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterator
+
+from limitador import PRIORIDAD_GENERACION
+
+RUTA_BANCO = os.getenv('BANCO_PREGUNTAS_PATH', 'banco_preguntas.db')
+# Preguntas frescas mínimas por (tema, nivel) antes de volver a llamar a Gemini
+MINIMO_PREGUNTAS = int(os.getenv('BANCO_MINIMO_PREGUNTAS', '30'))
+# Antigüedad máxima (horas) para considerar fresca una pregunta
+MAX_EDAD_HORAS = float(os.getenv('BANCO_MAX_EDAD_HORAS', '168'))
+
+TIPOS_PREGUNTA = ("opcion_multiple", "verdadero_falso", "respuesta_abierta")
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS preguntas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tema TEXT NOT NULL,
+    nivel TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    enunciado TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    creado REAL NOT NULL,
+    UNIQUE (tema, nivel, enunciado)
+);
+CREATE INDEX IF NOT EXISTS idx_preguntas_slot ON preguntas (tema, nivel, tipo, creado);
+"""
+
+
+def es_pregunta_valida(pregunta: Any) -> bool:
+    """Comprueba que una pregunta generada tenga la estructura esperada"""
+    if not isinstance(pregunta, dict):
+        return False
+
+    tipo = pregunta.get("tipo")
+    enunciado = pregunta.get("pregunta")
+    respuesta = pregunta.get("respuesta_correcta")
+    if tipo not in TIPOS_PREGUNTA or not isinstance(enunciado, str) or not enunciado.strip():
+        return False
+    if not isinstance(pregunta.get("explicacion"), str):
+        return False
+
+    if tipo == "respuesta_abierta":
+        return isinstance(respuesta, str) and bool(respuesta.strip())
+
+    opciones = pregunta.get("opciones")
+    claves = {"A", "B", "C", "D"} if tipo == "opcion_multiple" else {"A", "B"}
+    return (
+        isinstance(opciones, dict)
+        and set(opciones.keys()) == claves
+        and isinstance(respuesta, str)
+        and respuesta.strip().upper() in claves
+    )
+
+
+class BancoPreguntas:
+    def __init__(self, ruta: Optional[str] = None, minimo: Optional[int] = None,
+                 max_edad_horas: Optional[float] = None):
+        """Inicializa el banco sobre un archivo SQLite"""
+        self.ruta = ruta or RUTA_BANCO
+        self.minimo = MINIMO_PREGUNTAS if minimo is None else minimo
+        self.max_edad_segundos = (MAX_EDAD_HORAS if max_edad_horas is None else max_edad_horas) * 3600
+        self._lock = threading.Lock()
+        self._inicializado = False
+
+    @contextmanager
+    def _conexion(self):
+        """Abre una conexión por operación (seguro entre hilos)"""
+        conn = sqlite3.connect(self.ruta, timeout=10)
+        try:
+            if not self._inicializado:
+                with self._lock:
+                    if not self._inicializado:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(_ESQUEMA)
+                        self._inicializado = True
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def guardar(self, tema: str, nivel: str, preguntas: List[Dict[str, Any]]) -> int:
+        """
+        Guarda las preguntas válidas de un tema y nivel
+
+        Returns:
+            Número de preguntas nuevas insertadas
+        """
+        ahora = time.time()
+        filas = []
+        for p in preguntas:
+            if not es_pregunta_valida(p):
+                continue
+            datos = {k: v for k, v in p.items() if k != "id"}
+            filas.append((
+                tema, nivel, p["tipo"],
+                p["pregunta"].strip().casefold(),
+                json.dumps(datos, ensure_ascii=False),
+                ahora
+            ))
+
+        if not filas:
+            return 0
+
+        with self._conexion() as conn:
+            antes = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO preguntas (tema, nivel, tipo, enunciado, datos, creado) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                filas
+            )
+            return conn.total_changes - antes
+
+    def contar(self, tema: str, nivel: str, solo_frescas: bool = True) -> int:
+        """Cuenta las preguntas disponibles para un tema y nivel"""
+        limite = time.time() - self.max_edad_segundos if solo_frescas else 0
+        with self._conexion() as conn:
+            fila = conn.execute(
+                "SELECT COUNT(*) FROM preguntas WHERE tema = ? AND nivel = ? AND creado >= ?",
+                (tema, nivel, limite)
+            ).fetchone()
+        return fila[0]
+
+    def necesita_reponer(self, tema: str, nivel: str) -> bool:
+        """Indica si hay que generar más preguntas para este tema y nivel"""
+        return self.contar(tema, nivel) < self.minimo
+
+    def obtener_cuestionario(self, tema: str, nivel: str, cantidad: int = 10,
+                             solo_frescas: bool = True) -> List[Dict[str, Any]]:
+        """
+        Arma un cuestionario aleatorio desde el banco
+
+        Alterna los tipos de pregunta para que el cuestionario quede variado.
+
+        Returns:
+            Lista de preguntas con ids consecutivos (puede tener menos de `cantidad`)
+        """
+        limite = time.time() - self.max_edad_segundos if solo_frescas else 0
+        with self._conexion() as conn:
+            filas = conn.execute(
+                "SELECT tipo, datos FROM preguntas WHERE tema = ? AND nivel = ? AND creado >= ?",
+                (tema, nivel, limite)
+            ).fetchall()
+
+        por_tipo = {}
+        for tipo, datos in filas:
+            por_tipo.setdefault(tipo, []).append(datos)
+        for lista in por_tipo.values():
+            random.shuffle(lista)
+
+        seleccion = []
+        tipos = list(por_tipo.keys())
+        random.shuffle(tipos)
+        while len(seleccion) < cantidad and any(por_tipo.values()):
+            for tipo in tipos:
+                if por_tipo[tipo] and len(seleccion) < cantidad:
+                    seleccion.append(json.loads(por_tipo[tipo].pop()))
+
+        for i, p in enumerate(seleccion, start=1):
+            p["id"] = i
+        return seleccion
+
+
+_banco = None
+_banco_lock = threading.Lock()
+
+
+def obtener_banco() -> BancoPreguntas:
+    """Devuelve el banco de preguntas compartido del proceso"""
+    global _banco
+    if _banco is None:
+        with _banco_lock:
+            if _banco is None:
+                _banco = BancoPreguntas()
+    return _banco
+
+
+def _cuestionario_desde_banco(banco: BancoPreguntas, servicio, tema: str, nivel_academico: str,
+                              cantidad: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Devuelve un cuestionario del banco si no hace falta llamar a Gemini
+
+    Mientras Gemini no está disponible (circuit breaker abierto) se aceptan
+    también preguntas antiguas, antes que recurrir al fallback estático.
+    """
+    try:
+        if not servicio.disponible():
+            preguntas = banco.obtener_cuestionario(tema, nivel_academico, cantidad, solo_frescas=False)
+            if len(preguntas) >= cantidad:
+                print(f"Gemini no disponible: sirviendo '{tema}' desde el banco local")
+                return preguntas
+        elif not banco.necesita_reponer(tema, nivel_academico):
+            preguntas = banco.obtener_cuestionario(tema, nivel_academico, cantidad)
+            if len(preguntas) >= cantidad:
+                return preguntas
+    except sqlite3.Error as e:
+        print(f"Error leyendo el banco de preguntas: {e}")
+    return None
+
+
+def obtener_preguntas(servicio, tema: str, nivel_academico: str, cantidad: int = 10,
+                      prioridad: int = PRIORIDAD_GENERACION) -> List[Dict[str, Any]]:
+    """
+    Devuelve un cuestionario para el tema, usando el banco local si tiene
+    suficientes preguntas frescas y Gemini en caso contrario
+
+    Args:
+        servicio: GeminiService usado cuando el banco no alcanza
+        tema: El tema de estudio
+        nivel_academico: Nivel académico del estudiante
+        cantidad: Número de preguntas del cuestionario
+        prioridad: Prioridad de la generación en el limitador de Gemini
+    """
+    banco = obtener_banco()
+    preguntas = _cuestionario_desde_banco(banco, servicio, tema, nivel_academico, cantidad)
+    if preguntas:
+        return preguntas
+
+    preguntas = servicio.generar_preguntas(tema, nivel_academico, cantidad=cantidad, prioridad=prioridad)
+
+    try:
+        generadas = [p for p in preguntas if not servicio.es_pregunta_fallback(tema, p)]
+        nuevas = banco.guardar(tema, nivel_academico, generadas)
+        print(f"Banco de preguntas: {nuevas} preguntas nuevas para '{tema}' ({nivel_academico})")
+    except sqlite3.Error as e:
+        print(f"Error guardando en el banco de preguntas: {e}")
+
+    return preguntas
+
+
+def obtener_preguntas_stream(servicio, tema: str, nivel_academico: str,
+                             cantidad: int = 10) -> Iterator[Dict[str, Any]]:
+    """
+    Igual que obtener_preguntas, pero entrega las preguntas una a una
+
+    Si el banco alcanza, las preguntas salen de inmediato; si no, se van
+    entregando a medida que Gemini las genera y al final se guardan en el banco.
+    """
+    banco = obtener_banco()
+    preguntas = _cuestionario_desde_banco(banco, servicio, tema, nivel_academico, cantidad)
+    if preguntas:
+        yield from preguntas
+        return
+
+    generadas = []
+    for p in servicio.generar_preguntas_stream(tema, nivel_academico, cantidad=cantidad):
+        if not servicio.es_pregunta_fallback(tema, p):
+            generadas.append(p)
+        yield p
+
+    try:
+        nuevas = banco.guardar(tema, nivel_academico, generadas)
+        print(f"Banco de preguntas: {nuevas} preguntas nuevas para '{tema}' ({nivel_academico})")
+    except sqlite3.Error as e:
+        print(f"Error guardando en el banco de preguntas: {e}")
@@ -1,25 +1,159 @@
+import codecs
+import os
 import requests
 import re
+import threading
+import time
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
 from typing import List, Tuple
 
+# Segundos que un resultado se considera fresco
+CACHE_TTL = int(os.getenv('YOUTUBE_CACHE_TTL', '21600'))
+# Segundos que un resultado vencido todavía se sirve mientras se refresca
+CACHE_TTL_OBSOLETO = int(os.getenv('YOUTUBE_CACHE_TTL_OBSOLETO', '604800'))
+# Segundos que se recuerda un error o una búsqueda sin resultados
+CACHE_TTL_ERROR = int(os.getenv('YOUTUBE_CACHE_TTL_ERROR', '60'))
+CACHE_MAX_ENTRADAS = int(os.getenv('YOUTUBE_CACHE_MAX_ENTRADAS', '256'))
+
+_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/110.0 Safari/537.36"
+    )
+}
+_PATRON_VIDEO_ID = re.compile(r'"videoId":"([a-zA-Z0-9_-]{11})"')
+_TAMANO_BLOQUE = 16 * 1024
+# Un '"videoId":"<11 caracteres>"' mide 24; basta guardar uno menos
+_SOLAPAMIENTO = 23
+
+# Sesión HTTP compartida: reutiliza conexiones (keep-alive) entre búsquedas
+_sesion = requests.Session()
+_sesion.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+
+
+class CacheBusquedas:
+    """Caché LRU con TTL y stale-while-revalidate para las búsquedas de videos."""
+
+    def __init__(self, max_entradas: int = CACHE_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()  # clave -> (valor, fresco_hasta, valido_hasta)
+        self._refrescando = set()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        """Devuelve (valor, fresco) o (None, False) si no hay entrada utilizable."""
+        ahora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None, False
+            valor, fresco_hasta, valido_hasta = entrada
+            if ahora >= valido_hasta:
+                del self._entradas[clave]
+                return None, False
+            self._entradas.move_to_end(clave)
+            return valor, ahora < fresco_hasta
+
+    def guardar(self, clave, valor, ttl: int, ttl_obsoleto: int = 0):
+        ahora = time.time()
+        with self._lock:
+            self._entradas[clave] = (valor, ahora + ttl, ahora + ttl + ttl_obsoleto)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def marcar_refresco(self, clave) -> bool:
+        """Reserva el refresco de una clave; False si ya hay uno en curso."""
+        with self._lock:
+            if clave in self._refrescando:
+                return False
+            self._refrescando.add(clave)
+            return True
+
+    def terminar_refresco(self, clave):
+        with self._lock:
+            self._refrescando.discard(clave)
+
+
+_cache = CacheBusquedas()
+
+
+def _es_resultado_valido(resultados: List[Tuple[str, str]]) -> bool:
+    return bool(resultados) and resultados[0][0] not in ("Error", "Sin resultados")
+
+
+def _guardar_resultado(clave, resultados: List[Tuple[str, str]]):
+    if _es_resultado_valido(resultados):
+        _cache.guardar(clave, resultados, CACHE_TTL, CACHE_TTL_OBSOLETO)
+        return
+
+    # Caché negativa: no volver a intentar enseguida, pero sin pisar un
+    # resultado válido anterior que todavía se pueda servir
+    anterior, _ = _cache.obtener(clave)
+    if anterior is not None and _es_resultado_valido(anterior):
+        _cache.guardar(clave, anterior, CACHE_TTL_ERROR, CACHE_TTL_OBSOLETO)
+    else:
+        _cache.guardar(clave, resultados, CACHE_TTL_ERROR)
+
+
+def _refrescar(clave, consulta: str, num: int):
+    try:
+        _guardar_resultado(clave, _buscar_videos_youtube(consulta, num))
+    finally:
+        _cache.terminar_refresco(clave)
+
+
 def buscar_videos_youtube(consulta: str, num: int = 5) -> List[Tuple[str, str]]:
-    """Busca videos educativos en YouTube sin API."""
+    """Busca videos educativos en YouTube sin API (con caché).
+
+    Un resultado vencido se devuelve al instante y se refresca en segundo plano.
+    """
+    clave = (" ".join(consulta.split()).casefold(), num)
+    resultados, fresco = _cache.obtener(clave)
+
+    if resultados is None:
+        resultados = _buscar_videos_youtube(consulta, num)
+        _guardar_resultado(clave, resultados)
+    elif not fresco and _cache.marcar_refresco(clave):
+        threading.Thread(target=_refrescar, args=(clave, consulta, num), daemon=True).start()
+
+    # Copia: quien llama puede reordenar la lista
+    return list(resultados)
+
+
+def _buscar_videos_youtube(consulta: str, num: int = 5) -> List[Tuple[str, str]]:
+    """Busca videos educativos en YouTube sin API.
+
+    Lee la página de resultados en streaming y deja de descargar en cuanto
+    encuentra `num` videos distintos, conservando el orden de relevancia.
+    """
     resultados = []
     try:
-        headers = {
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/110.0 Safari/537.36"
-            )
-        }
+        video_ids = []
+        vistos = set()
+        decodificador = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pendiente = ""
 
-        query = consulta.replace(" ", "+")
-        url = f"https://www.youtube.com/results?search_query={query}"
-        resp = requests.get(url, headers=headers, timeout=10)
-        html = resp.text
-
-        video_ids = list(set(re.findall(r'"videoId":"([a-zA-Z0-9_-]{11})"', html)))
+        with _sesion.get(
+            "https://www.youtube.com/results",
+            params={"search_query": consulta},
+            headers=_HEADERS,
+            timeout=10,
+            stream=True,
+        ) as resp:
+            for bloque in resp.iter_content(chunk_size=_TAMANO_BLOQUE):
+                texto = pendiente + decodificador.decode(bloque)
+                for coincidencia in _PATRON_VIDEO_ID.finditer(texto):
+                    vid = coincidencia.group(1)
+                    if vid not in vistos:
+                        vistos.add(vid)
+                        video_ids.append(vid)
+                if len(video_ids) >= num:
+                    break
+                # Conservar el final por si un id quedó cortado entre bloques
+                pendiente = texto[-_SOLAPAMIENTO:]
 
         if not video_ids:
             return [("Sin resultados", "No se encontraron videos.")]
@@ -32,3 +166,15 @@ def buscar_videos_youtube(consulta: str, num: int = 5) -> List[Tuple[str, str]]:
 
     except Exception as e:
         return [("Error", str(e))]
+
+
+def descargar_pagina_resultados(consulta: str) -> str:
+    """Descarga completa la página de resultados de YouTube (para procesos batch)."""
+    resp = _sesion.get(
+        "https://www.youtube.com/results",
+        params={"search_query": consulta},
+        headers=_HEADERS,
+        timeout=20,
+    )
+    resp.raise_for_status()
+    return resp.text
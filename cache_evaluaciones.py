@@ -0,0 +1,185 @@
+"""
+Caché de evaluaciones de respuestas abiertas
+Recuerda la evaluación de Gemini para cada combinación de pregunta,
+respuesta esperada y respuesta del estudiante (sin distinguir mayúsculas,
+tildes ni espacios), de modo que las respuestas repetidas se califican al
+instante y siempre igual. Vive en memoria con desalojo LRU y,
+opcionalmente, se persiste en SQLite
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from calificacion_lexica import sin_tildes
+
+# Evaluaciones que se mantienen en memoria
+MAX_EVALUACIONES = int(os.getenv('CACHE_EVALUACIONES_MAX', '5000'))
+# Archivo SQLite donde persistirlas (vacío = solo en memoria)
+RUTA_CACHE = os.getenv('CACHE_EVALUACIONES_PATH', '')
+# Evaluaciones que se conservan en disco (se borran las más antiguas)
+MAX_EVALUACIONES_DISCO = int(os.getenv('CACHE_EVALUACIONES_MAX_DISCO', '100000'))
+# Inserciones entre recortes del archivo
+_RECORTE_CADA = 500
+# Versión de la clave: cambia si cambia la normalización, para no reutilizar
+# evaluaciones guardadas con claves de otra versión
+_VERSION_CLAVE = 2
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS evaluaciones (
+    clave TEXT PRIMARY KEY,
+    datos TEXT NOT NULL,
+    creado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_evaluaciones_creado ON evaluaciones (creado);
+"""
+
+
+def normalizar_respuesta(texto: Any) -> str:
+    """
+    Minúsculas, sin tildes y con los espacios unificados
+
+    Los signos, operadores y números se conservan: "r = -0.8" y "r = 0.8", o
+    "> 0" y "< 0", son respuestas distintas.
+    """
+    if not isinstance(texto, str):
+        return ""
+    return " ".join(sin_tildes(texto.lower()).split())
+
+
+def clave_evaluacion(pregunta: Dict[str, Any], respuesta: Any) -> str:
+    """Hash de (enunciado, respuesta esperada, respuesta normalizada del estudiante)"""
+    contenido = json.dumps(
+        [_VERSION_CLAVE, pregunta.get("pregunta", ""), pregunta.get("respuesta_correcta", ""),
+         normalizar_respuesta(respuesta)],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+def _es_cacheable(evaluacion: Any) -> bool:
+    return (
+        isinstance(evaluacion, dict)
+        and isinstance(evaluacion.get("correcta"), bool)
+        and isinstance(evaluacion.get("puntaje"), (int, float))
+        and isinstance(evaluacion.get("explicacion"), str)
+    )
+
+
+class CacheEvaluaciones:
+    def __init__(self, maximo: Optional[int] = None, ruta: Optional[str] = None,
+                 maximo_disco: Optional[int] = None):
+        """
+        Args:
+            maximo: Evaluaciones en memoria
+            ruta: Archivo SQLite para persistir (None usa CACHE_EVALUACIONES_PATH;
+                "" desactiva la persistencia)
+            maximo_disco: Evaluaciones que se conservan en el archivo
+        """
+        self.maximo = MAX_EVALUACIONES if maximo is None else maximo
+        self.ruta = RUTA_CACHE if ruta is None else ruta
+        self.maximo_disco = MAX_EVALUACIONES_DISCO if maximo_disco is None else maximo_disco
+        self._evaluaciones = OrderedDict()
+        self._aciertos = 0
+        self._fallos = 0
+        self._insertadas = 0
+        self._lock = threading.Lock()
+        self._lock_disco = threading.Lock()
+        self._inicializado = False
+
+    def obtener(self, pregunta: Dict[str, Any], respuesta: Any) -> Optional[Dict[str, Any]]:
+        """Devuelve una copia de la evaluación guardada, o None"""
+        clave = clave_evaluacion(pregunta, respuesta)
+        with self._lock:
+            evaluacion = self._evaluaciones.get(clave)
+            if evaluacion is not None:
+                self._evaluaciones.move_to_end(clave)
+
+        if evaluacion is None and self.ruta:
+            evaluacion = self._leer_disco(clave)
+            if evaluacion is not None:
+                self._recordar(clave, evaluacion)
+
+        with self._lock:
+            if evaluacion is None:
+                self._fallos += 1
+                return None
+            self._aciertos += 1
+        return dict(evaluacion)
+
+    def guardar(self, pregunta: Dict[str, Any], respuesta: Any, evaluacion: Dict[str, Any]):
+        """Guarda una evaluación válida (los errores de evaluación no se guardan)"""
+        if not _es_cacheable(evaluacion):
+            return
+        clave = clave_evaluacion(pregunta, respuesta)
+        evaluacion = {k: evaluacion[k] for k in ("correcta", "puntaje", "explicacion")}
+        self._recordar(clave, evaluacion)
+        if self.ruta:
+            self._escribir_disco(clave, evaluacion)
+
+    def estadisticas(self) -> Dict[str, int]:
+        """Tamaño en memoria y aciertos/fallos desde el arranque"""
+        with self._lock:
+            return {"tamano": len(self._evaluaciones), "aciertos": self._aciertos, "fallos": self._fallos}
+
+    def _recordar(self, clave: str, evaluacion: Dict[str, Any]):
+        with self._lock:
+            self._evaluaciones[clave] = evaluacion
+            self._evaluaciones.move_to_end(clave)
+            while len(self._evaluaciones) > self.maximo:
+                self._evaluaciones.popitem(last=False)
+
+    # ---------------------- Persistencia ------------------------
+
+    @contextmanager
+    def _conexion(self):
+        """Abre una conexión por operación (seguro entre hilos)"""
+        conn = sqlite3.connect(self.ruta, timeout=10)
+        try:
+            if not self._inicializado:
+                with self._lock_disco:
+                    if not self._inicializado:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(_ESQUEMA)
+                        self._inicializado = True
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _leer_disco(self, clave: str) -> Optional[Dict[str, Any]]:
+        try:
+            with self._conexion() as conn:
+                fila = conn.execute("SELECT datos FROM evaluaciones WHERE clave = ?", (clave,)).fetchone()
+            return json.loads(fila[0]) if fila else None
+        except sqlite3.Error as e:
+            print(f"Error leyendo la caché de evaluaciones: {e}")
+            return None
+
+    def _escribir_disco(self, clave: str, evaluacion: Dict[str, Any]):
+        try:
+            with self._conexion() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO evaluaciones (clave, datos, creado) VALUES (?, ?, ?)",
+                    (clave, json.dumps(evaluacion, ensure_ascii=False), time.time())
+                )
+                with self._lock:
+                    self._insertadas += 1
+                    recortar = self._insertadas % _RECORTE_CADA == 0
+                if recortar:
+                    conn.execute(
+                        "DELETE FROM evaluaciones WHERE creado < ("
+                        "SELECT creado FROM evaluaciones ORDER BY creado DESC LIMIT 1 OFFSET ?)",
+                        (self.maximo_disco - 1,)
+                    )
+        except sqlite3.Error as e:
+            print(f"Error guardando en la caché de evaluaciones: {e}")
+
+
+cache_evaluaciones = CacheEvaluaciones()
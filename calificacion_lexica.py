@@ -0,0 +1,197 @@
+"""
+Calificación léxica local de respuestas abiertas
+Compara la respuesta del estudiante con la respuesta esperada usando
+términos normalizados (sin tildes, sin palabras vacías y con un stemming
+ligero del español) ponderados por TF-IDF. Solo decide los casos claros
+(respuesta vacía, o una frase completa con casi todos los conceptos clave);
+todo lo demás, incluidas las respuestas sin coincidencias, que pueden ser
+paráfrasis correctas, se deja para Gemini
+"""
+
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+
+CALIFICACION_LEXICA = os.getenv('CALIFICACION_LEXICA', '1') == '1'
+# Cobertura ponderada de conceptos clave a partir de la cual se aprueba sin Gemini
+UMBRAL_APROBADO = float(os.getenv('CALIFICACION_LEXICA_APROBADO', '0.8'))
+# Palabras distintas mínimas de la respuesta, como fracción de las de la
+# esperada, para aprobar sin Gemini (una lista de palabras clave no basta)
+PROPORCION_LONGITUD = float(os.getenv('CALIFICACION_LEXICA_PROPORCION_LONGITUD', '0.6'))
+# Respuestas esperadas distintas que se recuerdan para calcular el IDF
+MAX_DOCUMENTOS = 2000
+
+_STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes asi aun aunque bajo bien cada casi como con contra
+cual cuales cuando de del desde donde dos durante e el ella ellas ello ellos en entre era eran es esa esas
+ese eso esos esta estaba estan estar estas este esto estos fue fueron ha habia han hasta hay la las le les
+lo los mas me mi mientras mismo mucho muy nos o otra otras otro otros para pero poco por porque pues que
+se sea segun ser si sido sin sobre solo son su sus tal tambien tanto te tiene tienen toda todas todo todos
+tu u un una unas uno unos usa usar ya y
+""".split())
+
+# Negaciones: si aparecen en la respuesta y no en la esperada, el caso es dudoso
+_NEGACIONES = frozenset(("no", "nunca", "jamas", "ningun", "ninguna", "ninguno", "tampoco", "ni"))
+
+# Sufijos del stemming ligero, del más largo al más corto
+_SUFIJOS = (
+    "amientos", "imientos", "aciones", "uciones", "amiento", "imiento", "adoras", "adores",
+    "ancias", "encias", "mente", "acion", "ucion", "ancia", "encia", "ables", "ibles",
+    "istas", "idades", "idad", "ador", "able", "ible", "ista", "osos", "osas", "ivos",
+    "ivas", "oso", "osa", "ivo", "iva", "ando", "iendo", "es", "as", "os", "a", "o", "e", "s",
+)
+
+_PATRON_PALABRA = re.compile(r"[a-zñ0-9]+")
+
+
+def sin_tildes(texto: str) -> str:
+    """Quita tildes y diéresis; la ñ se conserva (es una letra distinta, no una n con tilde)"""
+    texto = texto.replace("ñ", "\0")
+    texto = "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+    return texto.replace("\0", "ñ")
+
+
+def raiz(palabra: str) -> str:
+    """Stemming ligero: quita el sufijo más largo dejando una raíz de al menos 3 letras"""
+    for sufijo in _SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 3:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+
+def palabras(texto: Any) -> List[str]:
+    """Palabras en minúscula y sin tildes (incluye palabras vacías y negaciones)"""
+    if not isinstance(texto, str):
+        return []
+    return _PATRON_PALABRA.findall(sin_tildes(texto.lower()))
+
+
+def terminos(texto: Any) -> List[str]:
+    """Raíces de las palabras con contenido"""
+    return [raiz(p) for p in palabras(texto) if p not in _STOPWORDS and p not in _NEGACIONES]
+
+
+class CalificadorLexico:
+    def __init__(self, umbral_aprobado: float = UMBRAL_APROBADO,
+                 proporcion_longitud: float = PROPORCION_LONGITUD, max_documentos: int = MAX_DOCUMENTOS):
+        self.umbral_aprobado = umbral_aprobado
+        self.proporcion_longitud = proporcion_longitud
+        self.max_documentos = max_documentos
+        # Respuestas esperadas vistas (para el IDF) y en cuántas aparece cada término
+        self._documentos = OrderedDict()
+        self._frecuencia = Counter()
+        self._decisiones = Counter()
+        self._lock = threading.Lock()
+
+    def _registrar_documento(self, clave: str, terminos_documento: List[str]):
+        with self._lock:
+            if clave in self._documentos:
+                return
+            unicos = frozenset(terminos_documento)
+            self._documentos[clave] = unicos
+            self._frecuencia.update(unicos)
+            while len(self._documentos) > self.max_documentos:
+                _, viejos = self._documentos.popitem(last=False)
+                self._frecuencia.subtract(viejos)
+
+    def _idf(self, termino: str) -> float:
+        total = len(self._documentos)
+        return math.log((total + 1) / (self._frecuencia.get(termino, 0) + 1)) + 1
+
+    def puntuar(self, pregunta: Dict[str, Any], respuesta: str) -> Dict[str, Any]:
+        """
+        Mide qué parte de los conceptos clave de la respuesta esperada aparece en la del estudiante
+
+        Returns:
+            {"cobertura": 0..1 ponderada por IDF, "faltantes": conceptos no encontrados,
+            "terminos": términos útiles de la respuesta, "negacion": bool}
+        """
+        esperada = pregunta.get("respuesta_correcta", "")
+        terminos_esperados = terminos(esperada)
+        self._registrar_documento(esperada, terminos_esperados)
+
+        terminos_respuesta = terminos(respuesta)
+        # Lo que solo repite el enunciado aporta poco
+        de_la_pregunta = set(terminos(pregunta.get("pregunta", "")))
+        negaciones_respuesta = _NEGACIONES.intersection(palabras(respuesta))
+        negaciones_esperadas = _NEGACIONES.intersection(palabras(esperada))
+
+        with self._lock:
+            pesos = {
+                t: self._idf(t) * (0.3 if t in de_la_pregunta else 1.0)
+                for t in set(terminos_esperados)
+            }
+        total = sum(pesos.values())
+        encontrados = set(terminos_respuesta)
+        cobertura = sum(p for t, p in pesos.items() if t in encontrados) / total if total else 0.0
+
+        # Los conceptos faltantes se muestran como los escribió el docente (con tildes)
+        faltantes = []
+        for original in re.findall(r"\w+", esperada.lower() if isinstance(esperada, str) else ""):
+            normalizada = sin_tildes(original)
+            if normalizada not in _STOPWORDS and raiz(normalizada) in pesos and raiz(normalizada) not in encontrados:
+                faltantes.append(original)
+        return {
+            "cobertura": cobertura,
+            "faltantes": list(dict.fromkeys(faltantes)),
+            "terminos": terminos_respuesta,
+            "negacion": bool(negaciones_respuesta - negaciones_esperadas)
+        }
+
+    def calificar(self, pregunta: Dict[str, Any], respuesta: str) -> Optional[Dict[str, Any]]:
+        """
+        Califica una respuesta abierta si el caso es claro
+
+        Returns:
+            Evaluación con el formato de evaluar_respuesta, o None si hay que
+            consultar a Gemini
+        """
+        esperada = pregunta.get("respuesta_correcta", "")
+        puntuacion = self.puntuar(pregunta, respuesta)
+
+        if not terminos(esperada):
+            # Sin conceptos clave con los que comparar
+            decision = "dudosa"
+            evaluacion = None
+        elif not puntuacion["terminos"]:
+            decision = "vacia"
+            evaluacion = {
+                "correcta": False,
+                "puntaje": 0,
+                "explicacion": f"La respuesta está vacía o no contiene contenido. Respuesta esperada: {esperada}"
+            }
+        elif (puntuacion["cobertura"] >= self.umbral_aprobado and not puntuacion["negacion"]
+              and len(set(palabras(respuesta))) >= self.proporcion_longitud * len(set(palabras(esperada)))):
+            decision = "aprobada"
+            evaluacion = {
+                "correcta": True,
+                "puntaje": 1.0,
+                "explicacion": f"Tu respuesta incluye los conceptos clave. {pregunta.get('explicacion', '')}".strip()
+            }
+        else:
+            # Sin coincidencias puede ser una paráfrasis correcta: no se reprueba localmente
+            decision = "dudosa"
+            evaluacion = None
+
+        with self._lock:
+            self._decisiones[decision] += 1
+        return evaluacion
+
+    def estadisticas(self) -> Dict[str, int]:
+        """Cuántas respuestas se decidieron localmente y cuántas se enviaron a Gemini"""
+        with self._lock:
+            return {d: self._decisiones.get(d, 0) for d in ("vacia", "aprobada", "dudosa")}
+
+
+calificador_lexico = CalificadorLexico()
+
+
+def calificar_abierta(pregunta: Dict[str, Any], respuesta: str) -> Optional[Dict[str, Any]]:
+    """Evaluación local de una respuesta abierta, o None si debe decidir Gemini"""
+    if not CALIFICACION_LEXICA:
+        return None
+    return calificador_lexico.calificar(pregunta, respuesta)
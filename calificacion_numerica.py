@@ -0,0 +1,136 @@
+"""
+Calificación local de respuestas numéricas
+Interpreta lo que escribe el estudiante (decimales con coma o punto,
+separadores de miles, fracciones y porcentajes) y compara un lote completo
+de respuestas con los valores esperados en una sola pasada de NumPy
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Tolerancia relativa por defecto (0,5 %)
+TOLERANCIA_RELATIVA = float(os.getenv('CALIFICACION_TOLERANCIA_RELATIVA', '0.005'))
+
+_PATRON_FRACCION = re.compile(r"^([+-]?\d+(?:\.\d+)?)/(\d+(?:\.\d+)?)$")
+_PATRON_NUMERO = re.compile(r"^[+-]?(\d+(\.\d*)?|\.\d+)(e[+-]?\d+)?$")
+
+
+def _normalizar_separadores(texto: str) -> str:
+    """Convierte '1.234,5', '1,234.5' y '2,67' al formato con punto decimal"""
+    comas, puntos = texto.count(","), texto.count(".")
+    if comas and puntos:
+        # El último separador que aparece es el decimal
+        if texto.rfind(",") > texto.rfind("."):
+            return texto.replace(".", "").replace(",", ".")
+        return texto.replace(",", "")
+    if comas > 1:
+        return texto.replace(",", "")
+    if puntos > 1:
+        return texto.replace(".", "")
+    return texto.replace(",", ".")
+
+
+def interpretar_numero(texto: Any, porcentaje: bool = False) -> Optional[float]:
+    """
+    Convierte la respuesta de un estudiante en número
+
+    Args:
+        texto: Respuesta tal como la escribió ("2,67", "1/2", "25 %", "−3")
+        porcentaje: Si el valor esperado está expresado en porcentaje, "25%"
+            vale 25; si no, vale 0.25
+
+    Returns:
+        El número, o None si no se puede interpretar
+    """
+    if isinstance(texto, (int, float)) and not isinstance(texto, bool):
+        return float(texto)
+    if not isinstance(texto, str):
+        return None
+
+    limpio = texto.strip().lower().replace("−", "-").replace(" ", "").replace(" ", "")
+    es_porcentaje = limpio.endswith("%")
+    if es_porcentaje:
+        limpio = limpio[:-1]
+    if not limpio:
+        return None
+
+    fraccion = _PATRON_FRACCION.match(limpio.replace(",", "."))
+    if fraccion:
+        denominador = float(fraccion.group(2))
+        if denominador == 0:
+            return None
+        valor = float(fraccion.group(1)) / denominador
+    else:
+        limpio = _normalizar_separadores(limpio)
+        if not _PATRON_NUMERO.match(limpio):
+            return None
+        valor = float(limpio)
+
+    if es_porcentaje and not porcentaje:
+        valor /= 100
+    return valor
+
+
+def tolerancia_absoluta(decimales: Optional[int]) -> float:
+    """Media unidad del último decimal pedido (acepta el redondeo del estudiante)"""
+    return 0.5 * 10 ** -decimales if decimales is not None else 0.0
+
+
+def verificar_lote(respuestas: Sequence[Optional[float]], esperados: Sequence[float],
+                   tolerancias_absolutas: Optional[Sequence[float]] = None,
+                   tolerancia_relativa: float = TOLERANCIA_RELATIVA) -> np.ndarray:
+    """
+    Compara respuestas ya interpretadas con los valores esperados
+
+    Una respuesta es correcta si |r − e| <= max(atol, rtol · |e|); las que no se
+    pudieron interpretar (None) son incorrectas.
+
+    Returns:
+        Arreglo booleano con el resultado de cada respuesta
+    """
+    r = np.array([np.nan if v is None else v for v in respuestas], dtype=float)
+    e = np.asarray(esperados, dtype=float)
+    atol = np.zeros_like(e) if tolerancias_absolutas is None else np.asarray(tolerancias_absolutas, dtype=float)
+    limite = np.maximum(atol, tolerancia_relativa * np.abs(e))
+    # Un pequeño margen evita rechazar respuestas justo en el límite por error de coma flotante
+    return np.abs(r - e) <= limite * (1 + 1e-9) + 1e-12
+
+
+def calificar_lote(preguntas: List[Dict[str, Any]], respuestas_usuario: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Califica preguntas de tipo respuesta_numerica
+
+    Cada pregunta debe traer "valor" (o una "respuesta_correcta" interpretable)
+    y puede traer "decimales", "tolerancia" (absoluta) y "porcentaje".
+
+    Returns:
+        Evaluaciones con el formato de evaluar_respuesta, en el mismo orden
+    """
+    interpretadas = []
+    esperados = []
+    tolerancias = []
+    for pregunta, respuesta in zip(preguntas, respuestas_usuario):
+        porcentaje = bool(pregunta.get("porcentaje"))
+        esperado = pregunta.get("valor")
+        if esperado is None:
+            esperado = interpretar_numero(pregunta.get("respuesta_correcta"), porcentaje)
+        interpretadas.append(interpretar_numero(respuesta, porcentaje))
+        esperados.append(np.nan if esperado is None else esperado)
+        tolerancias.append(pregunta.get("tolerancia", tolerancia_absoluta(pregunta.get("decimales"))))
+
+    correctas = verificar_lote(interpretadas, esperados, tolerancias)
+
+    evaluaciones = []
+    for pregunta, interpretada, correcta in zip(preguntas, interpretadas, correctas):
+        explicacion = pregunta.get("explicacion", "")
+        if interpretada is None:
+            explicacion = f"No se pudo interpretar la respuesta como número. {explicacion}".strip()
+        evaluaciones.append({
+            "correcta": bool(correcta),
+            "puntaje": 1 if correcta else 0,
+            "explicacion": explicacion
+        })
+    return evaluaciones
@@ -0,0 +1,193 @@
+"""
+Catálogo local de videos por tema
+Un proceso batch recorre todos los temas, extrae de la página de resultados
+de YouTube el id, título, canal y duración de cada video y los guarda en
+SQLite. La ruta /visual lee de aquí sin hacer ninguna petición externa.
+
+Uso:
+    python catalogo_videos.py [--por-tema 12] [--ruta catalogo_videos.db]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from typing import List, Dict, Any, Tuple
+
+from busquedas import descargar_pagina_resultados
+from temas import temas
+
+RUTA_CATALOGO = os.getenv('CATALOGO_VIDEOS_PATH', 'catalogo_videos.db')
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    tema TEXT NOT NULL,
+    posicion INTEGER NOT NULL,
+    video_id TEXT NOT NULL,
+    titulo TEXT NOT NULL,
+    canal TEXT,
+    duracion TEXT,
+    actualizado REAL NOT NULL,
+    PRIMARY KEY (tema, video_id)
+);
+CREATE INDEX IF NOT EXISTS idx_videos_tema ON videos (tema, posicion);
+"""
+
+_MARCADOR_DATOS = "var ytInitialData = "
+
+
+def _texto(nodo: Any) -> str:
+    """Obtiene el texto de un nodo de YouTube ({"simpleText"} o {"runs": [...]})"""
+    if not isinstance(nodo, dict):
+        return ""
+    if "simpleText" in nodo:
+        return nodo["simpleText"]
+    return "".join(run.get("text", "") for run in nodo.get("runs", []))
+
+
+def _buscar_video_renderers(nodo: Any, encontrados: List[Dict[str, Any]]):
+    if isinstance(nodo, dict):
+        renderer = nodo.get("videoRenderer")
+        if isinstance(renderer, dict) and renderer.get("videoId"):
+            encontrados.append(renderer)
+        for valor in nodo.values():
+            _buscar_video_renderers(valor, encontrados)
+    elif isinstance(nodo, list):
+        for valor in nodo:
+            _buscar_video_renderers(valor, encontrados)
+
+
+def extraer_videos(html: str) -> List[Dict[str, str]]:
+    """
+    Extrae los videos (en orden de relevancia) de una página de resultados
+
+    Returns:
+        Lista de diccionarios con video_id, titulo, canal y duracion
+    """
+    inicio = html.find(_MARCADOR_DATOS)
+    if inicio == -1:
+        return []
+    inicio += len(_MARCADOR_DATOS)
+
+    try:
+        datos, _ = json.JSONDecoder().raw_decode(html, inicio)
+    except json.JSONDecodeError as e:
+        print(f"No se pudo leer ytInitialData: {e}")
+        return []
+
+    renderers = []
+    _buscar_video_renderers(datos, renderers)
+
+    videos = []
+    vistos = set()
+    for r in renderers:
+        if r["videoId"] in vistos:
+            continue
+        vistos.add(r["videoId"])
+        videos.append({
+            "video_id": r["videoId"],
+            "titulo": _texto(r.get("title")) or "Video educativo encontrado",
+            "canal": _texto(r.get("ownerText")),
+            "duracion": _texto(r.get("lengthText")),
+        })
+    return videos
+
+
+def _conectar(ruta: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(ruta, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_ESQUEMA)
+    return conn
+
+
+def guardar_videos_tema(conn: sqlite3.Connection, tema: str, videos: List[Dict[str, str]]):
+    """Reemplaza los videos de un tema en el catálogo"""
+    ahora = time.time()
+    with conn:
+        conn.execute("DELETE FROM videos WHERE tema = ?", (tema,))
+        conn.executemany(
+            "INSERT INTO videos (tema, posicion, video_id, titulo, canal, duracion, actualizado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (tema, i, v["video_id"], v["titulo"], v["canal"], v["duracion"], ahora)
+                for i, v in enumerate(videos)
+            ]
+        )
+
+
+def actualizar_catalogo(ruta: str = RUTA_CATALOGO, por_tema: int = 12, pausa: float = 1.0) -> Dict[str, int]:
+    """
+    Recorre todos los temas y actualiza el catálogo
+
+    Un tema que falla conserva los videos que ya tenía.
+
+    Returns:
+        Cantidad de videos guardados por tema
+    """
+    conn = _conectar(ruta)
+    resumen = {}
+    try:
+        for tema in temas["Estadística"]:
+            try:
+                html = descargar_pagina_resultados(f"{tema} Estadística")
+                videos = extraer_videos(html)[:por_tema]
+                if videos:
+                    guardar_videos_tema(conn, tema, videos)
+                resumen[tema] = len(videos)
+                print(f"{tema}: {len(videos)} videos")
+            except Exception as e:
+                resumen[tema] = 0
+                print(f"{tema}: error ({e})")
+            time.sleep(pausa)
+    finally:
+        conn.close()
+    return resumen
+
+
+def obtener_videos_catalogo(tema: str, num: int = 6, ruta: str = RUTA_CATALOGO) -> List[Tuple[str, str]]:
+    """
+    Devuelve los videos de un tema desde el catálogo local
+
+    Returns:
+        Lista de tuplas (titulo, link) en el mismo formato que
+        buscar_videos_youtube; vacía si el tema no está en el catálogo
+    """
+    if not os.path.exists(ruta):
+        return []
+
+    try:
+        conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True, timeout=5)
+        try:
+            filas = conn.execute(
+                "SELECT video_id, titulo, canal, duracion FROM videos "
+                "WHERE tema = ? ORDER BY posicion LIMIT ?",
+                (tema, num)
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error leyendo el catálogo de videos: {e}")
+        return []
+
+    videos = []
+    for video_id, titulo, canal, duracion in filas:
+        detalles = " · ".join(d for d in (canal, duracion) if d)
+        if detalles:
+            titulo = f"{titulo} ({detalles})"
+        videos.append((titulo, f"https://www.youtube.com/watch?v={video_id}"))
+    return videos
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Actualiza el catálogo local de videos por tema")
+    parser.add_argument("--ruta", default=RUTA_CATALOGO, help="Archivo SQLite del catálogo")
+    parser.add_argument("--por-tema", type=int, default=12, help="Videos a guardar por tema")
+    parser.add_argument("--pausa", type=float, default=1.0, help="Segundos entre búsquedas")
+    args = parser.parse_args()
+
+    resumen = actualizar_catalogo(args.ruta, args.por_tema, args.pausa)
+    faltantes = [tema for tema, n in resumen.items() if n == 0]
+    print(f"Catálogo actualizado: {sum(resumen.values())} videos en {len(resumen) - len(faltantes)} temas")
+    if faltantes:
+        print(f"Temas sin videos: {', '.join(faltantes)}")
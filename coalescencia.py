@@ -0,0 +1,60 @@
+"""
+Coalescencia de llamadas idénticas concurrentes (single-flight)
+Cuando varias peticiones piden lo mismo a la vez, solo la primera ejecuta
+el trabajo y las demás esperan y reciben el mismo resultado
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class _Llamada:
+    def __init__(self):
+        self.terminada = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class VueloUnico:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_vuelo: Dict[Hashable, _Llamada] = {}
+
+    def ejecutar(self, clave: Hashable, funcion: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        Ejecuta `funcion` salvo que ya haya una llamada en curso con la misma clave
+
+        Returns:
+            Tupla (resultado, compartido); `compartido` es True si el resultado
+            proviene de la llamada de otro hilo. Si la llamada original falla,
+            todos los que esperaban reciben la misma excepción.
+        """
+        with self._lock:
+            llamada = self._en_vuelo.get(clave)
+            lider = llamada is None
+            if lider:
+                llamada = _Llamada()
+                self._en_vuelo[clave] = llamada
+
+        if not lider:
+            llamada.terminada.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            return llamada.resultado, True
+
+        try:
+            llamada.resultado = funcion(*args, **kwargs)
+        except BaseException as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_vuelo[clave]
+            llamada.terminada.set()
+
+        return llamada.resultado, False
+
+    def en_vuelo(self) -> int:
+        """Número de llamadas distintas actualmente en curso"""
+        with self._lock:
+            return len(self._en_vuelo)
@@ -0,0 +1,94 @@
+"""
+Almacén de cuestionarios en el servidor
+Guarda las preguntas generadas (con sus respuestas correctas) bajo un id
+corto; el navegador solo recibe el id y las preguntas sin las respuestas,
+y al evaluar envía únicamente el id y sus respuestas
+"""
+
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+TTL_CUESTIONARIOS = int(os.getenv('CUESTIONARIOS_TTL_SEGUNDOS', '7200'))
+MAX_CUESTIONARIOS = int(os.getenv('CUESTIONARIOS_MAX', '5000'))
+
+# Campos que no se envían al navegador
+_CAMPOS_PRIVADOS = ("respuesta_correcta", "explicacion", "valor")
+
+
+def vista_publica(pregunta: Dict[str, Any]) -> Dict[str, Any]:
+    """Copia de la pregunta sin la respuesta correcta ni la explicación"""
+    return {k: v for k, v in pregunta.items() if k not in _CAMPOS_PRIVADOS}
+
+
+class AlmacenCuestionarios:
+    def __init__(self, ttl: Optional[int] = None, maximo: Optional[int] = None):
+        self.ttl = TTL_CUESTIONARIOS if ttl is None else ttl
+        self.maximo = MAX_CUESTIONARIOS if maximo is None else maximo
+        self._cuestionarios = OrderedDict()
+        self._lock = threading.Lock()
+
+    def crear(self, user_id: str, tema: str, preguntas: Optional[List[Dict[str, Any]]] = None) -> str:
+        """Registra un cuestionario y devuelve su id"""
+        quiz_id = secrets.token_urlsafe(9)
+        with self._lock:
+            self._purgar()
+            self._cuestionarios[quiz_id] = {
+                "user_id": user_id,
+                "tema": tema,
+                "preguntas": list(preguntas or []),
+                "expira": time.time() + self.ttl
+            }
+            while len(self._cuestionarios) > self.maximo:
+                self._cuestionarios.popitem(last=False)
+        return quiz_id
+
+    def agregar_pregunta(self, quiz_id: str, pregunta: Dict[str, Any]):
+        """Añade una pregunta a un cuestionario que se está generando en streaming"""
+        with self._lock:
+            cuestionario = self._cuestionarios.get(quiz_id)
+            if cuestionario is not None:
+                cuestionario["preguntas"].append(pregunta)
+
+    def tomar(self, quiz_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Retira el cuestionario para evaluarlo (cada cuestionario se evalúa una sola vez)
+
+        Returns:
+            Diccionario con tema y preguntas, o None si no existe, expiró, ya se
+            evaluó o es de otro usuario
+        """
+        with self._lock:
+            cuestionario = self._cuestionarios.get(quiz_id)
+            if cuestionario is None or cuestionario["user_id"] != user_id:
+                return None
+            del self._cuestionarios[quiz_id]
+            if cuestionario["expira"] < time.time():
+                return None
+            return {"tema": cuestionario["tema"], "preguntas": list(cuestionario["preguntas"]),
+                    "user_id": user_id, "expira": cuestionario["expira"]}
+
+    def devolver(self, quiz_id: str, cuestionario: Dict[str, Any]):
+        """Vuelve a guardar un cuestionario tomado cuya evaluación falló"""
+        with self._lock:
+            self._cuestionarios[quiz_id] = {
+                "user_id": cuestionario["user_id"],
+                "tema": cuestionario["tema"],
+                "preguntas": list(cuestionario["preguntas"]),
+                "expira": cuestionario["expira"]
+            }
+
+    def _purgar(self):
+        # Los cuestionarios se insertan en orden, así que los vencidos están al principio
+        ahora = time.time()
+        while self._cuestionarios:
+            quiz_id, cuestionario = next(iter(self._cuestionarios.items()))
+            if cuestionario["expira"] >= ahora:
+                break
+            del self._cuestionarios[quiz_id]
+
+
+almacen_cuestionarios = AlmacenCuestionarios()
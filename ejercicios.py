@@ -1,31 +1,436 @@
-import random
+"""
+Generador local de ejercicios numéricos
+Cada tema tiene plantillas que sortean un conjunto de datos, calculan la
+respuesta con NumPy y arman opciones con errores típicos como distractores;
+los ejercicios se generan al instante y sin llamar a Gemini
+"""
 
-def generar_ejercicio_aleatorio(tema):
-    ejemplos = {
-        "Probabilidad básica": {
-            "pregunta": "Si lanzas un dado, ¿cuál es la probabilidad de obtener un número par?",
-            "opciones": ["1/2", "1/3", "2/3", "1/6"],
-            "respuesta": "1/2",
-            "pista": "Recuerda que un dado tiene 3 números pares (2, 4 y 6) de 6 posibles.",
-            "guia": "Para resolver, divide el número de resultados favorables (3) entre el total de posibles (6)."
-        },
-        "Media aritmética y ponderada": {
-            "pregunta": "¿Cuál es la media de los números 2, 4, 6, 8, 10?",
-            "opciones": ["5", "6", "8", "4"],
-            "respuesta": "6",
-            "pista": "Suma todos los valores y divide por la cantidad de datos.",
-            "guia": "Media = (2+4+6+8+10)/5 = 30/5 = 6"
-        },
-        "Varianza y desviación estándar": {
-            "pregunta": "Si los datos son 2, 4 y 6, ¿cuál es su varianza?",
-            "opciones": ["2.67", "4", "8", "1.5"],
-            "respuesta": "2.67",
-            "pista": "Calcula primero la media, luego la suma de los cuadrados de las desviaciones dividida entre n.",
-            "guia": "Media=4. Varianza=((2−4)²+(4−4)²+(6−4)²)/3=8/3=2.67"
-        },
+import math
+from fractions import Fraction
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# tema -> plantillas que generan ejercicios de ese tema
+_PLANTILLAS: Dict[str, List[Callable[[np.random.Generator], Dict[str, Any]]]] = {}
+
+# Valores críticos z para los niveles de confianza usados
+_Z_CONFIANZA = {90: 1.645, 95: 1.96, 99: 2.576}
+
+
+def plantilla(*temas: str):
+    """Registra una plantilla para uno o varios temas"""
+    def registrar(funcion):
+        for tema in temas:
+            _PLANTILLAS.setdefault(tema, []).append(funcion)
+        return funcion
+    return registrar
+
+
+def temas_disponibles() -> List[str]:
+    return list(_PLANTILLAS)
+
+
+def formatear(valor: float, decimales: int = 2) -> str:
+    """Redondea y quita los ceros sobrantes (6.00 -> '6', 2.6667 -> '2.67')"""
+    texto = f"{valor:.{decimales}f}"
+    if "." in texto:
+        texto = texto.rstrip("0").rstrip(".")
+    return "0" if texto == "-0" else texto
+
+
+def _lista(datos) -> str:
+    return ", ".join(formatear(x) for x in datos)
+
+
+def _ejercicio(rng: np.random.Generator, pregunta: str, valor: float, distractores: List[float],
+               pista: str, guia: str, decimales: int = 2, respuesta: Optional[str] = None,
+               porcentaje: bool = False) -> Dict[str, Any]:
+    """Arma el ejercicio con cuatro opciones distintas (la correcta y tres distractores)"""
+    respuesta = respuesta or formatear(valor, decimales)
+    opciones = [respuesta]
+    for distractor in distractores:
+        texto = distractor if isinstance(distractor, str) else formatear(distractor, decimales)
+        if texto not in opciones and len(opciones) < 4:
+            opciones.append(texto)
+
+    # Completar con perturbaciones de la respuesta si los errores típicos coinciden;
+    # con valores muy pequeños se avanza de a una unidad del último decimal
+    unidad = 10 ** -decimales
+    escala = max(abs(valor), 5 * unidad)
+    intentos = 0
+    while len(opciones) < 4:
+        intentos += 1
+        if intentos <= 20:
+            candidato = valor + rng.choice([-1, 1]) * escala * rng.uniform(0.1, 0.6)
+        else:
+            candidato = valor + (intentos - 20) * unidad
+        texto = formatear(candidato, decimales)
+        if texto not in opciones:
+            opciones.append(texto)
+
+    rng.shuffle(opciones)
+    return {
+        "pregunta": pregunta,
+        "opciones": opciones,
+        "respuesta": respuesta,
+        "valor": float(valor),
+        "decimales": decimales,
+        "porcentaje": porcentaje,
+        "pista": pista,
+        "guia": guia
     }
 
-    if tema not in ejemplos:
-        tema = random.choice(list(ejemplos.keys()))
 
-    return ejemplos[tema]
+# ---------------------- Tendencia central ------------------------
+
+@plantilla("Media aritmética y ponderada", "Medidas de tendencia central")
+def _media(rng):
+    datos = rng.integers(1, 51, size=rng.integers(5, 9))
+    media = datos.mean()
+    return _ejercicio(
+        rng,
+        f"¿Cuál es la media de los números {_lista(datos)}?",
+        media,
+        [np.median(datos), datos.sum() / (len(datos) - 1), (datos.min() + datos.max()) / 2],
+        "Suma todos los valores y divide por la cantidad de datos.",
+        f"Media = {datos.sum()}/{len(datos)} = {formatear(media)}"
+    )
+
+
+@plantilla("Media aritmética y ponderada")
+def _media_ponderada(rng):
+    notas = rng.integers(40, 101, size=rng.integers(3, 6)) / 10
+    creditos = rng.integers(1, 6, size=len(notas))
+    media = np.average(notas, weights=creditos)
+    detalle = "; ".join(f"{formatear(n)} ({c} créditos)" for n, c in zip(notas, creditos))
+    return _ejercicio(
+        rng,
+        f"Un estudiante obtuvo estas notas: {detalle}. ¿Cuál es su promedio ponderado por créditos?",
+        media,
+        [notas.mean(), (notas * creditos).sum() / len(notas), np.median(notas)],
+        "Multiplica cada nota por sus créditos, suma y divide por el total de créditos.",
+        f"Promedio = {formatear((notas * creditos).sum())}/{creditos.sum()} = {formatear(media)}"
+    )
+
+
+@plantilla("Mediana y moda", "Medidas de tendencia central")
+def _mediana(rng):
+    datos = rng.integers(1, 41, size=rng.integers(5, 10))
+    mediana = np.median(datos)
+    ordenados = np.sort(datos)
+    return _ejercicio(
+        rng,
+        f"¿Cuál es la mediana de los datos {_lista(datos)}?",
+        mediana,
+        [datos.mean(), datos[len(datos) // 2], ordenados[len(datos) // 2 - 1]],
+        "Ordena los datos; si la cantidad es par, promedia los dos valores centrales.",
+        f"Datos ordenados: {_lista(ordenados)}. Mediana = {formatear(mediana)}"
+    )
+
+
+@plantilla("Mediana y moda")
+def _moda(rng):
+    valores = rng.choice(np.arange(1, 21), size=5, replace=False)
+    repeticiones = np.array([3, 2, 1, 1, 1])
+    datos = np.repeat(valores, repeticiones)
+    rng.shuffle(datos)
+    moda = int(np.bincount(datos).argmax())
+    return _ejercicio(
+        rng,
+        f"¿Cuál es la moda de los datos {_lista(datos)}?",
+        moda,
+        [valores[1], np.median(datos), datos.max()],
+        "La moda es el valor que más se repite.",
+        f"El valor {moda} aparece {repeticiones[0]} veces, más que cualquier otro.",
+        decimales=0
+    )
+
+
+# ---------------------- Dispersión ------------------------
+
+@plantilla("Varianza y desviación estándar", "Medidas de dispersión")
+def _varianza(rng):
+    datos = rng.integers(1, 21, size=rng.integers(4, 7))
+    media = datos.mean()
+    varianza = datos.var()
+    desviacion = datos.std()
+    cuadrados = ((datos - media) ** 2).sum()
+    if rng.random() < 0.5:
+        return _ejercicio(
+            rng,
+            f"Si los datos (de una población) son {_lista(datos)}, ¿cuál es su varianza?",
+            varianza,
+            [datos.var(ddof=1), desviacion, cuadrados],
+            "Calcula la media y luego el promedio de los cuadrados de las desviaciones (divide entre n).",
+            f"Media = {formatear(media)}. Varianza = {formatear(cuadrados)}/{len(datos)} = {formatear(varianza)}"
+        )
+    return _ejercicio(
+        rng,
+        f"Si los datos (de una población) son {_lista(datos)}, ¿cuál es su desviación estándar?",
+        desviacion,
+        [varianza, datos.std(ddof=1), np.abs(datos - media).mean()],
+        "La desviación estándar es la raíz cuadrada de la varianza.",
+        f"Varianza = {formatear(cuadrados)}/{len(datos)} = {formatear(varianza)}. "
+        f"Desviación = √{formatear(varianza)} = {formatear(desviacion)}"
+    )
+
+
+@plantilla("Coeficiente de variación", "Medidas de dispersión")
+def _coeficiente_variacion(rng):
+    datos = rng.integers(10, 61, size=rng.integers(4, 7))
+    media = datos.mean()
+    desviacion = datos.std()
+    cv = desviacion / media * 100
+    return _ejercicio(
+        rng,
+        f"Para los datos {_lista(datos)} (población), ¿cuál es el coeficiente de variación en porcentaje?",
+        cv,
+        [datos.std(ddof=1) / media * 100, datos.var() / media * 100, media / desviacion if desviacion else media],
+        "CV = desviación estándar / media × 100.",
+        f"Media = {formatear(media)}, desviación = {formatear(desviacion)}. "
+        f"CV = {formatear(desviacion)}/{formatear(media)} × 100 = {formatear(cv)}%",
+        porcentaje=True
+    )
+
+
+# ---------------------- Probabilidad ------------------------
+
+@plantilla("Probabilidad básica")
+def _probabilidad_urna(rng):
+    rojas, azules = (int(x) for x in rng.integers(1, 10, size=2))
+    total = rojas + azules
+    probabilidad = Fraction(rojas, total)
+    return _ejercicio(
+        rng,
+        f"Una urna tiene {rojas} bolas rojas y {azules} azules. "
+        f"Si se saca una al azar, ¿cuál es la probabilidad de que sea roja?",
+        float(probabilidad),
+        [str(Fraction(azules, total)), str(Fraction(rojas, azules)), str(Fraction(1, total)),
+         str(Fraction(rojas + 1, total))],
+        "Divide los casos favorables entre los casos posibles.",
+        f"P(roja) = {rojas}/{total} = {formatear(float(probabilidad), 4)}",
+        decimales=4,
+        respuesta=str(probabilidad)
+    )
+
+
+@plantilla("Distribución binomial", "Distribuciones de probabilidad")
+def _binomial(rng):
+    n = int(rng.integers(5, 13))
+    p = float(rng.choice([0.1, 0.2, 0.25, 0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8]))
+    # Un k cercano a n·p para que la probabilidad no sea despreciable
+    k = int(np.clip(round(n * p) + rng.integers(-2, 3), 0, n))
+    combinaciones = math.comb(n, k)
+    probabilidad = combinaciones * p ** k * (1 - p) ** (n - k)
+    acumulada = sum(math.comb(n, i) * p ** i * (1 - p) ** (n - i) for i in range(k + 1))
+    return _ejercicio(
+        rng,
+        f"Un experimento tiene probabilidad de éxito {formatear(p)} y se repite {n} veces de forma "
+        f"independiente. ¿Cuál es la probabilidad de obtener exactamente {k} éxitos?",
+        probabilidad,
+        [p ** k * (1 - p) ** (n - k), acumulada, combinaciones * p ** k],
+        "Usa P(X=k) = C(n,k) · p^k · (1−p)^(n−k).",
+        f"P(X={k}) = C({n},{k}) · {formatear(p)}^{k} · {formatear(1 - p)}^{n - k} = {formatear(probabilidad, 4)}",
+        decimales=4
+    )
+
+
+def _normal_acumulada(z: float) -> float:
+    return 0.5 * (1 + math.erf(z / math.sqrt(2)))
+
+
+@plantilla("Distribución normal", "Distribuciones de probabilidad")
+def _normal(rng):
+    media = int(rng.integers(50, 101))
+    sigma = int(rng.integers(5, 16))
+    x = media + int(rng.integers(-25, 26))
+    z = (x - media) / sigma
+    if rng.random() < 0.5:
+        return _ejercicio(
+            rng,
+            f"Una variable sigue una distribución normal con media {media} y desviación estándar {sigma}. "
+            f"¿Cuál es el puntaje z de x = {x}?",
+            z,
+            [(x - media) / sigma ** 2, (media - x) / sigma, x / sigma],
+            "z = (x − μ) / σ.",
+            f"z = ({x} − {media}) / {sigma} = {formatear(z)}"
+        )
+    probabilidad = _normal_acumulada(round(z, 2))
+    return _ejercicio(
+        rng,
+        f"Una variable sigue una distribución normal con media {media} y desviación estándar {sigma}. "
+        f"¿Cuál es P(X < {x})? (redondea z a dos decimales)",
+        probabilidad,
+        [1 - probabilidad, _normal_acumulada(round(z, 2) / 2), abs(probabilidad - 0.5)],
+        "Estandariza con z = (x − μ) / σ y busca Φ(z) en la tabla normal.",
+        f"z = ({x} − {media}) / {sigma} = {formatear(z)}; P(X < {x}) = Φ({formatear(z)}) = {formatear(probabilidad, 4)}",
+        decimales=4
+    )
+
+
+# ---------------------- Relación entre variables ------------------------
+
+def _datos_lineales(rng):
+    n = int(rng.integers(5, 8))
+    x = np.sort(rng.choice(np.arange(1, 21), size=n, replace=False))
+    pendiente = rng.choice([-3, -2, -1.5, -1, 0.5, 1, 1.5, 2, 3])
+    ruido = rng.normal(0, abs(pendiente) * rng.uniform(1, 5), size=n)
+    y = np.round(rng.integers(0, 11) + pendiente * x + ruido).astype(int)
+    return x, y
+
+
+def _tabla(x, y) -> str:
+    return "; ".join(f"({a}, {b})" for a, b in zip(x, y))
+
+
+@plantilla("Correlación y coeficiente de Pearson")
+def _pearson(rng):
+    x, y = _datos_lineales(rng)
+    r = np.corrcoef(x, y)[0, 1]
+    return _ejercicio(
+        rng,
+        f"Calcula el coeficiente de correlación de Pearson para los pares (x, y): {_tabla(x, y)}",
+        r,
+        [r ** 2, -r, np.polyfit(x, y, 1)[0]],
+        "r = Σ(x−x̄)(y−ȳ) / √(Σ(x−x̄)² · Σ(y−ȳ)²).",
+        f"x̄ = {formatear(x.mean())}, ȳ = {formatear(y.mean())}; r = {formatear(r, 3)}",
+        decimales=3
+    )
+
+
+@plantilla("Regresión lineal simple")
+def _regresion(rng):
+    x, y = _datos_lineales(rng)
+    pendiente, intercepto = np.polyfit(x, y, 1)
+    if rng.random() < 0.5:
+        return _ejercicio(
+            rng,
+            f"Ajusta una recta de mínimos cuadrados y = a + b·x a los pares (x, y): {_tabla(x, y)}. "
+            f"¿Cuál es la pendiente b?",
+            pendiente,
+            [intercepto, np.corrcoef(x, y)[0, 1], (y[-1] - y[0]) / (x[-1] - x[0])],
+            "b = Σ(x−x̄)(y−ȳ) / Σ(x−x̄)².",
+            f"b = {formatear(pendiente)}, a = ȳ − b·x̄ = {formatear(intercepto)}"
+        )
+    x0 = int(rng.integers(1, 21))
+    prediccion = intercepto + pendiente * x0
+    return _ejercicio(
+        rng,
+        f"Ajusta una recta de mínimos cuadrados y = a + b·x a los pares (x, y): {_tabla(x, y)}. "
+        f"¿Qué valor de y predice para x = {x0}?",
+        prediccion,
+        [pendiente * x0, intercepto + x0, y.mean()],
+        "Calcula b y a = ȳ − b·x̄, y sustituye x en la recta.",
+        f"b = {formatear(pendiente)}, a = {formatear(intercepto)}; "
+        f"ŷ = {formatear(intercepto)} + {formatear(pendiente)}·{x0} = {formatear(prediccion)}"
+    )
+
+
+# ---------------------- Inferencia ------------------------
+
+@plantilla("Intervalos de confianza", "Muestreo y poblaciones")
+def _intervalo_confianza(rng):
+    n = int(rng.choice([16, 25, 36, 49, 64, 81, 100]))
+    media = int(rng.integers(40, 121))
+    sigma = int(rng.integers(4, 21))
+    confianza = int(rng.choice(list(_Z_CONFIANZA)))
+    z = _Z_CONFIANZA[confianza]
+    margen = z * sigma / math.sqrt(n)
+    otro_z = _Z_CONFIANZA[95 if confianza != 95 else 99]
+    planteamiento = (
+        f"Una muestra de {n} observaciones tiene media {media}; la desviación estándar poblacional "
+        f"es {sigma}. Para un intervalo de confianza del {confianza}% (z = {z}), "
+    )
+    guia = f"E = {z} · {sigma}/√{n} = {formatear(margen)}; IC = {media} ± {formatear(margen)}"
+    if rng.random() < 0.5:
+        return _ejercicio(
+            rng,
+            planteamiento + "¿cuál es el margen de error?",
+            margen,
+            [z * sigma / n, z * sigma, otro_z * sigma / math.sqrt(n)],
+            "E = z · σ / √n.",
+            guia
+        )
+    return _ejercicio(
+        rng,
+        planteamiento + "¿cuál es el límite inferior del intervalo?",
+        media - margen,
+        [media - z * sigma / n, media + margen, media - otro_z * sigma / math.sqrt(n)],
+        "Límite inferior = x̄ − z · σ / √n.",
+        guia
+    )
+
+
+# ---------------------- API ------------------------
+
+def generar_ejercicio(tema: str, rng: Optional[np.random.Generator] = None) -> Dict[str, Any]:
+    """
+    Genera un ejercicio numérico nuevo de un tema
+
+    Si el tema no tiene plantillas se usa uno al azar de los disponibles.
+    """
+    rng = rng or np.random.default_rng()
+    plantillas = _PLANTILLAS.get(tema)
+    if not plantillas:
+        temas = temas_disponibles()
+        tema = temas[int(rng.integers(len(temas)))]
+        plantillas = _PLANTILLAS[tema]
+    ejercicio = plantillas[int(rng.integers(len(plantillas)))](rng)
+    ejercicio["tema"] = tema
+    return ejercicio
+
+
+def generar_ejercicios(tema: str, cantidad: int, semilla: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Genera `cantidad` ejercicios (reproducibles si se indica una semilla)"""
+    rng = np.random.default_rng(semilla)
+    return [generar_ejercicio(tema, rng) for _ in range(cantidad)]
+
+
+def _indicacion_redondeo(decimales: int) -> str:
+    """Precisión pedida al estudiante; debe coincidir con la tolerancia de la calificación"""
+    if decimales <= 0:
+        return "(redondea el resultado a un número entero)"
+    if decimales == 1:
+        return "(redondea el resultado a 1 decimal)"
+    return f"(redondea el resultado a {decimales} decimales)"
+
+
+def como_pregunta(ejercicio: Dict[str, Any], id_pregunta: int, opciones: bool = True) -> Dict[str, Any]:
+    """
+    Convierte un ejercicio al formato de pregunta de los cuestionarios
+
+    Args:
+        opciones: Opción múltiple; si es False, el estudiante escribe el número
+            (tipo respuesta_numerica, calificado con tolerancia)
+    """
+    explicacion = f"{ejercicio['guia']} (Pista: {ejercicio['pista']})"
+    if not opciones:
+        return {
+            "id": id_pregunta,
+            "tipo": "respuesta_numerica",
+            # La tolerancia es de media unidad en el último decimal: hay que decir cuántos
+            "pregunta": f"{ejercicio['pregunta']} {_indicacion_redondeo(ejercicio['decimales'])}",
+            "respuesta_correcta": ejercicio["respuesta"],
+            "valor": ejercicio["valor"],
+            "decimales": ejercicio["decimales"],
+            "porcentaje": ejercicio["porcentaje"],
+            "explicacion": explicacion
+        }
+
+    letras = "ABCD"
+    opciones = dict(zip(letras, ejercicio["opciones"]))
+    correcta = letras[ejercicio["opciones"].index(ejercicio["respuesta"])]
+    return {
+        "id": id_pregunta,
+        "tipo": "opcion_multiple",
+        "pregunta": ejercicio["pregunta"],
+        "opciones": opciones,
+        "respuesta_correcta": correcta,
+        "explicacion": explicacion
+    }
+
+
+def generar_ejercicio_aleatorio(tema):
+    """Ejercicio con pregunta, opciones, respuesta, pista y guía"""
+    return generar_ejercicio(tema)
@@ -0,0 +1,228 @@
+"""
+Escritura diferida (write-behind) del progreso de los estudiantes
+Las rutas registran el progreso en memoria y un hilo lo vuelca a Firebase
+cada pocos segundos: los eventos de un mismo usuario y tema se agrupan
+(los contadores se suman y gana el último acceso) y todos los usuarios
+pendientes se escriben en una sola actualización multi-ruta. Si esa
+escritura falla, se reintenta usuario por usuario para que una entrada
+rechazada no bloquee al resto, y las que fallan demasiadas veces se descartan.
+El mismo hilo aplica cada cierto tiempo la retención del historial de
+evaluaciones de los usuarios que evaluaron desde la última pasada
+"""
+
+import atexit
+import os
+import threading
+import time
+from typing import Any, Dict, List, Set
+
+from firebase_config import StudentData, student_cache
+
+# Segundos entre volcados; 0 escribe en el momento (sin buffer)
+INTERVALO_VOLCADO = float(os.getenv('PROGRESO_VOLCADO_SEGUNDOS', '5'))
+# Volcados fallidos tras los cuales se descarta el progreso pendiente de un usuario
+MAX_REINTENTOS = int(os.getenv('PROGRESO_MAX_REINTENTOS', '5'))
+# Segundos entre pasadas de retención del historial; 0 la desactiva
+INTERVALO_COMPACTACION = float(os.getenv('HISTORIAL_COMPACTACION_SEGUNDOS', '3600'))
+
+
+class BufferProgreso:
+    def __init__(self, intervalo: float = INTERVALO_VOLCADO, intervalo_compactacion: float = INTERVALO_COMPACTACION,
+                 max_reintentos: int = MAX_REINTENTOS):
+        """
+        Args:
+            intervalo: Segundos entre volcados a Firebase
+            intervalo_compactacion: Segundos entre pasadas de retención del historial
+            max_reintentos: Volcados fallidos antes de descartar el progreso de un usuario
+        """
+        self.intervalo = intervalo
+        self.intervalo_compactacion = intervalo_compactacion
+        self.max_reintentos = max_reintentos
+        # user_id -> tema -> {"ejercicios_completados": n, "ultimo_acceso": {...}}
+        self._progreso: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # user_id -> evaluaciones pendientes de agregar al historial
+        self._evaluaciones: Dict[str, List[Dict[str, Any]]] = {}
+        # Usuarios con progreso pendiente que la caché no llegó a reflejar
+        self._sin_cache = set()
+        # user_id -> volcados fallidos seguidos de su progreso pendiente
+        self._fallos: Dict[str, int] = {}
+        # Usuarios cuyo historial hay que migrar/recortar en la próxima pasada
+        self._por_compactar = set()
+        self._ultima_compactacion = time.monotonic()
+        self._lock = threading.Lock()
+        # Serializa los volcados (hilo periódico y atexit)
+        self._lock_volcado = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    @property
+    def activo(self) -> bool:
+        return self.intervalo > 0
+
+    def iniciar(self):
+        """Arranca el hilo de volcado periódico y el volcado al terminar el proceso"""
+        if self._hilo is not None or not (self.activo or self.intervalo_compactacion > 0):
+            return
+        self._hilo = threading.Thread(target=self._bucle, name='volcado-progreso', daemon=True)
+        self._hilo.start()
+        atexit.register(self.detener)
+
+    def detener(self):
+        """Detiene el hilo y vuelca lo pendiente"""
+        self._detener.set()
+        self.volcar()
+
+    def registrar_progreso(self, user_id: str, tema: str, ejercicio_completado: bool = False):
+        """Registra una visita o un ejercicio completado de un tema"""
+        acceso = StudentData.access_record(ejercicio_completado)
+        completados = 1 if ejercicio_completado else 0
+
+        if not self.activo:
+            StudentData.update_student_progress(user_id, tema, ejercicio_completado)
+            return
+
+        with self._lock:
+            temas = self._progreso.setdefault(user_id, {})
+            pendiente = temas.setdefault(tema, {"ejercicios_completados": 0, "ultimo_acceso": None})
+            pendiente["ejercicios_completados"] += completados
+            pendiente["ultimo_acceso"] = acceso
+
+            # La caché refleja el progreso ya, aunque Firebase lo reciba después;
+            # si el perfil no estaba cacheado se invalida tras el volcado
+            if not student_cache.patch(user_id, StudentData.progress_updates(tema, completados, acceso)):
+                self._sin_cache.add(user_id)
+
+    def registrar_evaluacion(self, user_id: str, evaluacion: Dict[str, Any]):
+        """Registra una evaluación para agregarla al historial"""
+        with self._lock:
+            self._por_compactar.add(user_id)
+            if self.activo:
+                self._evaluaciones.setdefault(user_id, []).append(evaluacion)
+                return
+
+        resultado = StudentData.save_evaluation_history(user_id, evaluacion)
+        if not resultado["success"]:
+            print(f"Error guardando historial de {user_id}: {resultado['error']}")
+
+    def pendientes(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "usuarios": len(self._progreso),
+                "temas": sum(len(temas) for temas in self._progreso.values()),
+                "evaluaciones": sum(len(e) for e in self._evaluaciones.values())
+            }
+
+    def volcar(self):
+        """Escribe en Firebase todo lo pendiente; lo que falla vuelve al buffer hasta agotar los reintentos"""
+        with self._lock_volcado:
+            with self._lock:
+                progreso, self._progreso = self._progreso, {}
+                evaluaciones, self._evaluaciones = self._evaluaciones, {}
+                sin_cache, self._sin_cache = self._sin_cache, set()
+
+            devueltos = self._volcar_progreso(progreso) if progreso else set()
+            for user_id in sin_cache - devueltos:
+                student_cache.invalidate(user_id)
+            if devueltos:
+                # La caché de los devueltos se invalida cuando por fin se escriban
+                with self._lock:
+                    self._sin_cache |= devueltos
+
+            if evaluaciones:
+                resultado = StudentData.append_evaluations(evaluaciones)
+                if not resultado["success"]:
+                    print(f"Error guardando historial de {len(evaluaciones)} usuarios: {resultado['error']}")
+                    with self._lock:
+                        for user_id, lista in evaluaciones.items():
+                            self._evaluaciones[user_id] = lista + self._evaluaciones.get(user_id, [])
+
+    def compactar(self):
+        """Migra el historial antiguo y aplica la retención a los usuarios que evaluaron"""
+        with self._lock:
+            usuarios, self._por_compactar = self._por_compactar, set()
+        self._ultima_compactacion = time.monotonic()
+
+        for user_id in usuarios:
+            migracion = StudentData.migrate_evaluation_history(user_id)
+            if not migracion["success"]:
+                print(f"Error migrando historial de {user_id}: {migracion['error']}")
+            resultado = StudentData.compact_evaluation_history(user_id)
+            if not resultado["success"]:
+                print(f"Error compactando historial de {user_id}: {resultado['error']}")
+                with self._lock:
+                    self._por_compactar.add(user_id)
+
+    def _volcar_progreso(self, progreso: Dict[str, Dict[str, Dict[str, Any]]]) -> Set[str]:
+        """Escribe el progreso y devuelve los usuarios que volvieron al buffer"""
+        actualizaciones = {}
+        for user_id, temas in progreso.items():
+            rutas = {}
+            for tema, pendiente in temas.items():
+                rutas.update(StudentData.progress_updates(
+                    tema, pendiente["ejercicios_completados"], pendiente["ultimo_acceso"]
+                ))
+            actualizaciones[user_id] = rutas
+
+        # La caché ya tiene estos cambios desde registrar_progreso
+        resultado = StudentData.update_many_students(actualizaciones, patch_cache=False)
+        if resultado["success"]:
+            with self._lock:
+                for user_id in progreso:
+                    self._fallos.pop(user_id, None)
+            return set()
+
+        print(f"Error volcando progreso de {len(progreso)} usuarios: {resultado['error']}")
+        if len(actualizaciones) == 1:
+            fallidos = dict.fromkeys(actualizaciones, resultado["error"])
+        else:
+            # Por usuario, para que una entrada rechazada no bloquee a las demás
+            fallidos = {}
+            for user_id, rutas in actualizaciones.items():
+                resultado = StudentData.update_many_students({user_id: rutas}, patch_cache=False)
+                if not resultado["success"]:
+                    fallidos[user_id] = resultado["error"]
+
+        devueltos = set()
+        with self._lock:
+            for user_id in progreso:
+                if user_id not in fallidos:
+                    self._fallos.pop(user_id, None)
+                    continue
+
+                fallos = self._fallos.get(user_id, 0) + 1
+                if fallos >= self.max_reintentos:
+                    # Se descarta solo lo que falló; lo registrado después sigue pendiente
+                    self._fallos.pop(user_id, None)
+                    print(f"Descartando progreso de {user_id} tras {fallos} volcados fallidos "
+                          f"({sorted(progreso[user_id])}): {fallidos[user_id]}")
+                    continue
+
+                self._fallos[user_id] = fallos
+                devueltos.add(user_id)
+                actuales = self._progreso.setdefault(user_id, {})
+                for tema, pendiente in progreso[user_id].items():
+                    actual = actuales.get(tema)
+                    if actual is None:
+                        actuales[tema] = pendiente
+                    else:
+                        # Lo registrado después del volcado conserva su último acceso
+                        actual["ejercicios_completados"] += pendiente["ejercicios_completados"]
+        return devueltos
+
+    def _bucle(self):
+        espera = self.intervalo if self.activo else self.intervalo_compactacion
+        while not self._detener.wait(espera):
+            try:
+                self.volcar()
+            except Exception as e:
+                print(f"Error en el volcado de progreso: {e}")
+
+            if (self.intervalo_compactacion > 0
+                    and time.monotonic() - self._ultima_compactacion >= self.intervalo_compactacion):
+                try:
+                    self.compactar()
+                except Exception as e:
+                    print(f"Error en la compactación del historial: {e}")
+
+
+buffer_progreso = BufferProgreso()
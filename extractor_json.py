@@ -0,0 +1,186 @@
+"""
+Extracción incremental de JSON desde respuestas de Gemini
+Permite obtener cada objeto completo de un arreglo JSON a medida que
+llega el texto en streaming, sin esperar a que termine la respuesta, y
+extraer el JSON de una respuesta completa aunque venga rodeada de texto
+(```json, explicaciones) o cortada a la mitad
+"""
+
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+# Posiciones de '[' o '{' que se prueban antes de pasar a la recuperación parcial
+_MAX_INTENTOS = 20
+
+_decodificador = json.JSONDecoder()
+
+
+class ExtractorObjetosJSON:
+    """
+    Recorre el texto recibido por partes y devuelve los objetos completos
+    que son elementos directos del arreglo JSON principal.
+    """
+
+    def __init__(self, validar: Optional[Callable[[Any], bool]] = None):
+        """
+        Args:
+            validar: Función que decide si un objeto tiene la estructura
+                esperada; los que no la cumplen se descartan
+        """
+        self.validar = validar
+        self.descartados = 0
+        self._buffer = ""
+        self._pos = 0
+        self._profundidad = 0
+        self._en_cadena = False
+        self._escape = False
+        self._inicio_objeto = None
+        self._dentro_arreglo = False
+
+    def alimentar(self, texto: str) -> List[Dict[str, Any]]:
+        """
+        Agrega texto al buffer y devuelve los objetos que quedaron completos
+
+        Args:
+            texto: Fragmento nuevo de la respuesta
+
+        Returns:
+            Lista (posiblemente vacía) de objetos parseados en orden
+        """
+        self._buffer += texto
+        objetos = []
+
+        while self._pos < len(self._buffer):
+            c = self._buffer[self._pos]
+
+            if self._en_cadena:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._en_cadena = False
+            elif not self._dentro_arreglo:
+                # Ignorar cualquier texto previo al arreglo (p. ej. ```json)
+                if c == "[":
+                    self._dentro_arreglo = True
+                    self._profundidad = 1
+            elif c == '"':
+                self._en_cadena = True
+            elif c in "{[":
+                if c == "{" and self._profundidad == 1:
+                    self._inicio_objeto = self._pos
+                self._profundidad += 1
+            elif c in "}]":
+                self._profundidad -= 1
+                if c == "}" and self._profundidad == 1 and self._inicio_objeto is not None:
+                    fragmento = self._buffer[self._inicio_objeto:self._pos + 1]
+                    self._inicio_objeto = None
+                    try:
+                        objeto = json.loads(fragmento)
+                        if isinstance(objeto, dict) and (self.validar is None or self.validar(objeto)):
+                            objetos.append(objeto)
+                        else:
+                            self.descartados += 1
+                    except json.JSONDecodeError as e:
+                        self.descartados += 1
+                        print(f"Objeto JSON inválido en el stream: {e}")
+                elif self._profundidad == 0:
+                    self._dentro_arreglo = False
+
+            self._pos += 1
+
+        # Descartar lo ya procesado que no forma parte de un objeto abierto
+        corte = self._inicio_objeto if self._inicio_objeto is not None else self._pos
+        if corte > 0:
+            self._buffer = self._buffer[corte:]
+            self._pos -= corte
+            if self._inicio_objeto is not None:
+                self._inicio_objeto = 0
+
+        return objetos
+
+    @property
+    def incompleto(self) -> bool:
+        """True si el texto recibido termina sin cerrar el arreglo principal"""
+        return self._dentro_arreglo
+
+
+def _lista_de_objetos(valor: Any) -> List[Any]:
+    """Elementos del arreglo, o los del primer arreglo de un objeto envoltorio ({"preguntas": [...]})"""
+    if isinstance(valor, list):
+        return valor
+    if isinstance(valor, dict):
+        for contenido in valor.values():
+            if isinstance(contenido, list) and contenido and all(isinstance(e, dict) for e in contenido):
+                return contenido
+        return [valor]
+    return []
+
+
+def _elementos(texto: str) -> List[Any]:
+    """
+    Elementos del primer arreglo JSON del texto, ignorando lo que haya antes
+    y después; si el arreglo está truncado, los objetos que alcanzaron a
+    completarse
+    """
+    inicio = 0
+    for _ in range(_MAX_INTENTOS):
+        candidatos = [i for i in (texto.find("[", inicio), texto.find("{", inicio)) if i >= 0]
+        if not candidatos:
+            break
+        inicio = min(candidatos)
+        try:
+            valor, _ = _decodificador.raw_decode(texto, inicio)
+            return _lista_de_objetos(valor)
+        except json.JSONDecodeError:
+            pass
+        # JSON truncado (o un corchete del texto previo): recuperar lo que esté completo
+        extractor = ExtractorObjetosJSON()
+        recuperados = extractor.alimentar(texto[inicio:])
+        if recuperados:
+            if extractor.incompleto:
+                print(f"JSON truncado: se recuperaron {len(recuperados)} objetos completos")
+            return recuperados
+        inicio += 1
+    return []
+
+
+def extraer_objetos(texto: str, validar: Optional[Callable[[Any], bool]] = None) -> List[Dict[str, Any]]:
+    """
+    Extrae los objetos de un arreglo JSON en cualquier parte del texto
+
+    Si la respuesta llegó truncada, devuelve todos los objetos que alcanzaron
+    a completarse. Los que no pasan `validar` se descartan.
+
+    Returns:
+        Objetos válidos en orden (posiblemente ninguno)
+    """
+    elementos = _elementos(texto)
+    objetos = [e for e in elementos if isinstance(e, dict) and (validar is None or validar(e))]
+    if len(objetos) < len(elementos):
+        print(f"Se descartaron {len(elementos) - len(objetos)} objetos JSON con estructura inválida")
+    return objetos
+
+
+def extraer_objeto(texto: str, validar: Optional[Callable[[Any], bool]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Extrae el primer objeto JSON del texto que pase `validar`
+
+    Returns:
+        El objeto, o None si no hay ninguno válido
+    """
+    inicio = 0
+    for _ in range(_MAX_INTENTOS):
+        inicio = texto.find("{", inicio)
+        if inicio < 0:
+            break
+        try:
+            valor, fin = _decodificador.raw_decode(texto, inicio)
+        except json.JSONDecodeError:
+            inicio += 1
+            continue
+        if isinstance(valor, dict) and (validar is None or validar(valor)):
+            return valor
+        inicio = fin
+    return None
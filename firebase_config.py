@@ -1,9 +1,18 @@
 import firebase_admin
 from firebase_admin import credentials, auth, db
-import requests
 import json
 from flask import session
 import os
+import copy
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from verificacion_tokens import (
+    VerificadorTokens, TokenInvalidoError, TokenExpiradoError, CertificadosNoDisponiblesError, sesion_http
+)
 
 # Configuración de Firebase - usando el proyecto del archivo firebase-key.json
 FIREBASE_CONFIG = {
@@ -14,6 +23,10 @@ FIREBASE_CONFIG = {
 # URLs de Firebase REST API
 FIREBASE_AUTH_URL = f"https://identitytoolkit.googleapis.com/v1/accounts"
 FIREBASE_DB_URL = f"https://{FIREBASE_CONFIG['projectId']}-default-rtdb.firebaseio.com"
+FIREBASE_TOKEN_URL = "https://securetoken.googleapis.com/v1/token"
+
+# Verificación local de los ID tokens (certificados de Google en caché)
+token_verifier = VerificadorTokens(FIREBASE_CONFIG['projectId'])
 
 # Inicializar Firebase Admin SDK
 def initialize_firebase():
@@ -41,6 +54,139 @@ def initialize_firebase():
 # Inicializar Firebase al importar el módulo
 initialize_firebase()
 
+# Caché en proceso de perfiles de estudiantes
+STUDENT_CACHE_TTL = int(os.environ.get('STUDENT_CACHE_TTL', '300'))
+STUDENT_CACHE_MAX = int(os.environ.get('STUDENT_CACHE_MAX', '1000'))
+
+class StudentCache:
+    """Caché LRU con TTL de los perfiles leídos de Firebase.
+
+    Devuelve y guarda copias para que nadie modifique la entrada cacheada
+    sin pasar por StudentData.
+    """
+    def __init__(self, ttl=STUDENT_CACHE_TTL, max_entries=STUDENT_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            data, expires = entry
+            if expires < time.time():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return copy.deepcopy(data)
+
+    def set(self, user_id, data):
+        with self._lock:
+            self._entries[user_id] = (copy.deepcopy(data), time.time() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def patch(self, user_id, updates):
+        """Aplica una actualización multi-ruta a la entrada cacheada, si existe
+        
+        Returns:
+            True si había entrada cacheada y se actualizó
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return False
+            apply_updates(entry[0], updates)
+            return True
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+student_cache = StudentCache()
+
+# Historial de evaluaciones: colección aparte, una clave push por evaluación
+HISTORY_MAX_ENTRIES = int(os.environ.get('HISTORIAL_MAX_EVALUACIONES', '500'))
+HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORIAL_RETENCION_DIAS', '365'))
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+class PushKeyGenerator:
+    """Genera localmente claves como las de push() de Realtime Database.
+
+    Las 8 primeras letras codifican los milisegundos, así que las claves se
+    ordenan por fecha; las 12 restantes son aleatorias y se incrementan si
+    se generan varias en el mismo milisegundo.
+    """
+    def __init__(self):
+        self._last_time = None
+        self._last_random = [0] * 12
+        self._lock = threading.Lock()
+
+    def generate(self, timestamp_ms=None):
+        now = int(time.time() * 1000) if timestamp_ms is None else int(timestamp_ms)
+        with self._lock:
+            if now == self._last_time:
+                # Mismo milisegundo: sumar 1 a la parte aleatoria para mantener el orden
+                i = 11
+                while i >= 0 and self._last_random[i] == 63:
+                    self._last_random[i] = 0
+                    i -= 1
+                if i >= 0:
+                    self._last_random[i] += 1
+            else:
+                self._last_time = now
+                self._last_random = [random.randrange(64) for _ in range(12)]
+            random_chars = ''.join(PUSH_CHARS[n] for n in self._last_random)
+        return push_key_prefix(now) + random_chars
+
+def push_key_prefix(timestamp_ms):
+    """Parte temporal de una clave push; sirve de cota para consultas por fecha"""
+    chars = []
+    timestamp_ms = int(timestamp_ms)
+    for _ in range(8):
+        chars.append(PUSH_CHARS[timestamp_ms % 64])
+        timestamp_ms //= 64
+    return ''.join(reversed(chars))
+
+push_keys = PushKeyGenerator()
+
+def increment(amount=1):
+    """Valor de servidor de Realtime Database que suma `amount` de forma atómica"""
+    return {".sv": {"increment": amount}}
+
+def is_increment(value):
+    return isinstance(value, dict) and isinstance(value.get(".sv"), dict) and "increment" in value[".sv"]
+
+def get_path(data, path):
+    """Obtiene el valor en una ruta 'a/b/c' de un diccionario (None si no existe)"""
+    for key in [k for k in path.split('/') if k]:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return copy.deepcopy(data)
+
+def apply_updates(data, updates):
+    """Aplica localmente una actualización multi-ruta (incluidos los incrementos)"""
+    for path, value in updates.items():
+        keys = [k for k in path.split('/') if k]
+        node = data
+        for key in keys[:-1]:
+            if not isinstance(node.get(key), dict):
+                node[key] = {}
+            node = node[key]
+        if is_increment(value):
+            current = node.get(keys[-1])
+            node[keys[-1]] = (current if isinstance(current, (int, float)) else 0) + value[".sv"]["increment"]
+        elif value is None:
+            node.pop(keys[-1], None)
+        else:
+            node[keys[-1]] = copy.deepcopy(value)
+    return data
+
 class FirebaseAuth:
     @staticmethod
     def login_user(email, password):
@@ -62,7 +208,7 @@ class FirebaseAuth:
                 "returnSecureToken": True
             }
 
-            resp = requests.post(url, json=payload, timeout=10)
+            resp = sesion_http.post(url, json=payload, timeout=10)
             if resp.status_code == 200:
                 data = resp.json()
                 return {
@@ -92,6 +238,53 @@ class FirebaseAuth:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    @staticmethod
+    def refresh_id_token(refresh_token):
+        """Obtiene un ID token nuevo a partir del refresh token (Secure Token API)"""
+        try:
+            api_key = os.environ.get("FIREBASE_WEB_API_KEY")
+            if not api_key:
+                return {"success": False, "error": "Falta configurar FIREBASE_WEB_API_KEY"}
+            
+            resp = sesion_http.post(
+                f"{FIREBASE_TOKEN_URL}?key={api_key}",
+                data={"grant_type": "refresh_token", "refresh_token": refresh_token},
+                timeout=10
+            )
+            if resp.status_code != 200:
+                return {"success": False, "error": "No se pudo renovar la sesión"}
+            
+            data = resp.json()
+            return {
+                "success": True,
+                "user": {
+                    "localId": data.get("user_id"),
+                    "idToken": data.get("id_token"),
+                    "refreshToken": data.get("refresh_token")
+                }
+            }
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def verify_id_token(id_token):
+        """Verifica localmente un ID token (sin llamadas de red salvo al refrescar certificados)
+        
+        Returns:
+            {"success": True, "uid": ..., "claims": ...} o {"success": False, "error": ...,
+            "expired": True si el token solo está vencido}
+        """
+        try:
+            claims = token_verifier.verificar(id_token)
+            return {"success": True, "uid": claims["sub"], "claims": claims}
+        except TokenExpiradoError as e:
+            return {"success": False, "error": str(e), "expired": True}
+        except TokenInvalidoError as e:
+            return {"success": False, "error": str(e), "expired": False}
+        except CertificadosNoDisponiblesError as e:
+            # No es culpa del token: quien llama decide si confiar en la sesión
+            return {"success": False, "error": str(e), "expired": False, "unavailable": True}
+    
     @staticmethod
     def register_user(email, password):
         """Registra un nuevo usuario usando Firebase Admin SDK"""
@@ -127,88 +320,338 @@ class FirebaseAuth:
         """Obtiene el usuario actual autenticado"""
         return session.get('user')
 
+# Almacenamiento de StudentData: 'firebase' (Realtime Database) o 'sqlite' (archivo local)
+STUDENT_BACKEND = os.environ.get('STUDENT_BACKEND', 'firebase')
+
+class StudentBackend(ABC):
+    """Interfaz de almacenamiento que usa StudentData.
+
+    Las rutas son relativas al estudiante ('progreso/Tema/videos_vistos') y las
+    actualizaciones multi-ruta pueden llevar increment(n).
+    """
+    @abstractmethod
+    def get_student(self, user_id):
+        """Documento completo del estudiante o None"""
+        ...
+    
+    @abstractmethod
+    def get_student_field(self, user_id, path):
+        ...
+    
+    @abstractmethod
+    def set_student(self, user_id, data):
+        ...
+    
+    @abstractmethod
+    def update_students(self, updates_by_user):
+        """Aplica {user_id: {ruta: valor}} en una sola escritura"""
+        ...
+    
+    @abstractmethod
+    def append_evaluations(self, entries_by_user):
+        """Agrega {user_id: {clave: evaluación}} al historial"""
+        ...
+    
+    @abstractmethod
+    def get_evaluations(self, user_id, limit, before=None):
+        """Últimas `limit` evaluaciones con clave menor que `before`, como [(clave, evaluación)] ascendente"""
+        ...
+    
+    @abstractmethod
+    def get_evaluation_keys(self, user_id):
+        ...
+    
+    @abstractmethod
+    def delete_evaluations(self, user_id, keys):
+        ...
+    
+    @abstractmethod
+    def move_legacy_history(self, user_id, entries_by_key):
+        """Guarda las evaluaciones en el historial y borra historial_evaluaciones del estudiante, de forma atómica"""
+        ...
+
+class FirebaseBackend(StudentBackend):
+    """StudentData sobre Firebase Realtime Database (Admin SDK)"""
+    def get_student(self, user_id):
+        return db.reference(f'students/{user_id}').get()
+    
+    def get_student_field(self, user_id, path):
+        return db.reference(f'students/{user_id}/{path}').get()
+    
+    def set_student(self, user_id, data):
+        db.reference(f'students/{user_id}').set(data)
+    
+    def update_students(self, updates_by_user):
+        updates = {
+            f"{user_id}/{path}": value
+            for user_id, user_updates in updates_by_user.items()
+            for path, value in user_updates.items()
+        }
+        if updates:
+            db.reference('students').update(updates)
+    
+    def append_evaluations(self, entries_by_user):
+        updates = {
+            f"{user_id}/{key}": evaluation
+            for user_id, entries in entries_by_user.items()
+            for key, evaluation in entries.items()
+        }
+        if updates:
+            db.reference('historial').update(updates)
+    
+    def get_evaluations(self, user_id, limit, before=None):
+        query = db.reference(f'historial/{user_id}').order_by_key()
+        if before:
+            # end_at es inclusivo: se pide una de más y se descarta `before`
+            query = query.end_at(before)
+        rows = query.limit_to_last(limit + 1 if before else limit).get() or {}
+        items = sorted((k, v) for k, v in rows.items() if not before or k < before)
+        return items[-limit:] if limit else []
+    
+    def get_evaluation_keys(self, user_id):
+        # shallow: solo las claves, no el contenido de las evaluaciones
+        return sorted(db.reference(f'historial/{user_id}').get(shallow=True) or {})
+    
+    def delete_evaluations(self, user_id, keys):
+        if keys:
+            db.reference(f'historial/{user_id}').update({k: None for k in keys})
+    
+    def move_legacy_history(self, user_id, entries_by_key):
+        updates = {f"historial/{user_id}/{key}": entry for key, entry in entries_by_key.items()}
+        updates[f"students/{user_id}/historial_evaluaciones"] = None
+        # Una sola escritura en la raíz: se copia y se borra de forma atómica
+        db.reference().update(updates)
+
+_student_backend = None
+_student_backend_lock = threading.Lock()
+
+def get_student_backend():
+    """Backend configurado en STUDENT_BACKEND (se crea una sola vez)"""
+    global _student_backend
+    if _student_backend is None:
+        with _student_backend_lock:
+            if _student_backend is None:
+                if STUDENT_BACKEND == 'sqlite':
+                    from almacen_sqlite import SQLiteBackend
+                    _student_backend = SQLiteBackend()
+                elif STUDENT_BACKEND == 'firebase':
+                    _student_backend = FirebaseBackend()
+                else:
+                    raise ValueError(f"STUDENT_BACKEND desconocido: {STUDENT_BACKEND}")
+                print(f"Almacenamiento de estudiantes: {STUDENT_BACKEND}")
+    return _student_backend
+
 class StudentData:
     @staticmethod
     def save_student_data(user_id, student_data):
-        """Guarda los datos del estudiante en Firebase Realtime Database usando Admin SDK"""
+        """Guarda los datos del estudiante (Firebase Realtime Database o SQLite local)"""
         try:
-            # Usar Firebase Admin SDK para escribir en Realtime Database
-            ref = db.reference(f'students/{user_id}')
-            ref.set(student_data)
+            get_student_backend().set_student(user_id, student_data)
+            student_cache.set(user_id, student_data)
             return {"success": True}
         except Exception as e:
+            # El estado remoto es incierto: forzar una lectura nueva
+            student_cache.invalidate(user_id)
             return {"success": False, "error": str(e)}
     
     @staticmethod
-    def get_student_data(user_id):
-        """Obtiene los datos del estudiante desde Firebase Realtime Database usando Admin SDK"""
+    def get_student_data(user_id, use_cache=True):
+        """Obtiene los datos del estudiante (desde la caché o el almacenamiento)"""
+        if use_cache:
+            data = student_cache.get(user_id)
+            if data is not None:
+                return {"success": True, "data": data}
+        
         try:
-            ref = db.reference(f'students/{user_id}')
-            data = ref.get()
+            data = get_student_backend().get_student(user_id)
             
             if data:
+                student_cache.set(user_id, data)
                 return {"success": True, "data": data}
             else:
                 return {"success": False, "error": "No se encontraron datos del estudiante"}
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    @staticmethod
+    def get_student_field(user_id, path):
+        """Lee solo un campo del estudiante (p. ej. 'progreso/Mediana y moda')"""
+        cached = student_cache.get(user_id)
+        if cached is not None:
+            return {"success": True, "data": get_path(cached, path)}
+        
+        try:
+            data = get_student_backend().get_student_field(user_id, path)
+            return {"success": True, "data": data}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def update_student_fields(user_id, updates):
+        """Actualiza varios campos del estudiante en una sola escritura multi-ruta
+        
+        Las claves son rutas relativas al estudiante ('progreso/Tema/ultimo_acceso')
+        y los valores pueden ser increment(n) para sumar en el servidor.
+        Solo viajan los campos modificados, no el documento completo.
+        """
+        try:
+            get_student_backend().update_students({user_id: updates})
+            student_cache.patch(user_id, updates)
+            return {"success": True}
+        except Exception as e:
+            student_cache.invalidate(user_id)
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def update_many_students(updates_by_user, patch_cache=True):
+        """Aplica actualizaciones multi-ruta de varios estudiantes en una sola escritura
+        
+        Args:
+            updates_by_user: {user_id: {ruta_relativa: valor}}
+            patch_cache: Aplicar también los cambios a la caché de perfiles
+        """
+        try:
+            get_student_backend().update_students(updates_by_user)
+            if patch_cache:
+                for user_id, user_updates in updates_by_user.items():
+                    student_cache.patch(user_id, user_updates)
+            return {"success": True}
+        except Exception as e:
+            for user_id in updates_by_user:
+                student_cache.invalidate(user_id)
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def increment_student_counter(user_id, path, amount=1):
+        """Incrementa un contador del estudiante de forma atómica en el servidor"""
+        return StudentData.update_student_fields(user_id, {path: increment(amount)})
+    
+    @staticmethod
+    def progress_updates(tema, ejercicios_completados=0, ultimo_acceso=None):
+        """Construye la actualización multi-ruta del progreso de un tema"""
+        base = f"progreso/{tema}"
+        # Los incrementos de 0 crean los contadores si el tema es nuevo
+        updates = {
+            f"{base}/ejercicios_completados": increment(ejercicios_completados),
+            f"{base}/videos_vistos": increment(0)
+        }
+        if ultimo_acceso is not None:
+            updates[f"{base}/ultimo_acceso"] = ultimo_acceso
+        return updates
+    
+    @staticmethod
+    def access_record(ejercicio_completado=False):
+        """Registro de último acceso a un tema"""
+        return {
+            "fecha": str(__import__('datetime').datetime.now()),
+            "tipo": "ejercicio" if ejercicio_completado else "visualizacion"
+        }
+    
     @staticmethod
     def update_student_progress(user_id, tema, ejercicio_completado=False):
         """Actualiza el progreso del estudiante"""
+        updates = StudentData.progress_updates(
+            tema,
+            ejercicios_completados=1 if ejercicio_completado else 0,
+            ultimo_acceso=StudentData.access_record(ejercicio_completado)
+        )
+        return StudentData.update_student_fields(user_id, updates)
+    
+    @staticmethod
+    def save_evaluation_history(user_id, evaluation_data):
+        """Guarda el historial de evaluaciones del estudiante"""
+        return StudentData.append_evaluations({user_id: [evaluation_data]})
+    
+    @staticmethod
+    def append_evaluations(evaluations_by_user):
+        """Agrega evaluaciones al historial de uno o varios estudiantes en una sola escritura
+        
+        Cada evaluación se guarda en historial/{user_id}/{clave push}: agregar no
+        reescribe las anteriores y el perfil del estudiante no crece con el historial.
+        """
+        entries_by_user = {
+            user_id: {push_keys.generate(): evaluation for evaluation in evaluations}
+            for user_id, evaluations in evaluations_by_user.items()
+            if evaluations
+        }
+        if not entries_by_user:
+            return {"success": True}
+        
         try:
-            # Obtener datos actuales
-            current_data = StudentData.get_student_data(user_id)
-            if not current_data["success"]:
-                return current_data
-            
-            data = current_data["data"]
-            if "progreso" not in data:
-                data["progreso"] = {}
-            
-            if tema not in data["progreso"]:
-                data["progreso"][tema] = {
-                    "ejercicios_completados": 0,
-                    "ultimo_acceso": None,
-                    "videos_vistos": 0
-                }
-            
-            if ejercicio_completado:
-                data["progreso"][tema]["ejercicios_completados"] += 1
-            
-            data["progreso"][tema]["ultimo_acceso"] = {
-                "fecha": str(__import__('datetime').datetime.now()),
-                "tipo": "ejercicio" if ejercicio_completado else "visualizacion"
+            get_student_backend().append_evaluations(entries_by_user)
+            return {"success": True}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def get_evaluation_history(user_id, limit=20, before=None):
+        """Obtiene una página del historial, de la evaluación más reciente a la más antigua
+        
+        Args:
+            limit: Evaluaciones por página
+            before: Clave de la última evaluación de la página anterior
+        
+        Returns:
+            {"success": True, "data": [evaluación con su "id"], "next": clave para
+            pedir la página siguiente o None si no hay más}
+        """
+        try:
+            # Se pide una de más para saber si hay otra página
+            items = get_student_backend().get_evaluations(user_id, limit + 1, before)
+            has_more = len(items) > limit
+            items = items[-limit:] if limit else []
+            return {
+                "success": True,
+                "data": [dict(v, id=k) for k, v in reversed(items)],
+                "next": items[0][0] if has_more and items else None
             }
-            
-            return StudentData.save_student_data(user_id, data)
         except Exception as e:
             return {"success": False, "error": str(e)}
     
     @staticmethod
-    def save_evaluation_history(user_id, evaluation_data):
-        """Guarda el historial de evaluaciones del estudiante"""
+    def migrate_evaluation_history(user_id):
+        """Mueve el historial antiguo (arreglo dentro del estudiante) a la colección"""
         try:
-            # Obtener datos actuales del estudiante
-            result = StudentData.get_student_data(user_id)
-            if not result["success"]:
-                return {"success": False, "error": "No se pudieron cargar los datos del estudiante"}
+            backend = get_student_backend()
+            legacy = backend.get_student_field(user_id, 'historial_evaluaciones')
+            if not legacy:
+                return {"success": True, "migrated": 0}
             
-            data = result["data"]
+            # Realtime Database puede devolver los arreglos como diccionarios
+            entries = legacy if isinstance(legacy, list) else [legacy[k] for k in sorted(legacy, key=str)]
+            entries_by_key = {}
+            for entry in entries:
+                if not isinstance(entry, dict):
+                    continue
+                try:
+                    fecha = __import__('datetime').datetime.fromisoformat(entry.get("fecha", ""))
+                    key = push_keys.generate(fecha.timestamp() * 1000)
+                except (TypeError, ValueError):
+                    key = push_keys.generate()
+                entries_by_key[key] = entry
             
-            # Inicializar historial si no existe
-            if "historial_evaluaciones" not in data:
-                data["historial_evaluaciones"] = []
-            
-            # Agregar nueva evaluación al historial
-            data["historial_evaluaciones"].append(evaluation_data)
+            backend.move_legacy_history(user_id, entries_by_key)
+            student_cache.patch(user_id, {"historial_evaluaciones": None})
+            return {"success": True, "migrated": len(entries_by_key)}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def compact_evaluation_history(user_id, max_entries=HISTORY_MAX_ENTRIES, retention_days=HISTORY_RETENTION_DAYS):
+        """Borra las evaluaciones que exceden el máximo o la antigüedad permitidos
+        
+        Solo se leen las claves, no el contenido de las evaluaciones.
+        """
+        try:
+            backend = get_student_backend()
+            keys = backend.get_evaluation_keys(user_id)
             
-            # Mantener solo las últimas 50 evaluaciones
-            if len(data["historial_evaluaciones"]) > 50:
-                data["historial_evaluaciones"] = data["historial_evaluaciones"][-50:]
+            remove = keys[:-max_entries] if max_entries and len(keys) > max_entries else []
+            if retention_days:
+                cutoff = push_key_prefix((time.time() - retention_days * 86400) * 1000)
+                remove += [k for k in keys[len(remove):] if k < cutoff]
             
-            return StudentData.save_student_data(user_id, data)
+            backend.delete_evaluations(user_id, remove)
+            return {"success": True, "removed": len(remove)}
         except Exception as e:
             return {"success": False, "error": str(e)}
-
-
@@ -4,22 +4,134 @@ Genera preguntas dinámicas y evalúa respuestas
 """
 
 import os
+import copy
 import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Iterator, Union
+
+from banco_preguntas import es_pregunta_valida
+from cache_evaluaciones import cache_evaluaciones, clave_evaluacion
+from calificacion_lexica import calificador_lexico, calificar_abierta
+from calificacion_numerica import calificar_lote
+from coalescencia import VueloUnico
+from extractor_json import ExtractorObjetosJSON, extraer_objeto, extraer_objetos
+from limitador import PRIORIDAD_EVALUACION, PRIORIDAD_GENERACION, PrioridadDinamica, limitador_gemini
+from llamadas_resilientes import CircuitBreaker, InvocadorResiliente
+
+MODELO_POR_DEFECTO = 'gemini-2.5-flash'
+
+# Máximo de evaluaciones abiertas en paralelo por proceso
+MAX_EVALUACIONES_PARALELAS = int(os.getenv('GEMINI_MAX_EVALUACIONES_PARALELAS', '4'))
+_pool_evaluacion = ThreadPoolExecutor(
+    max_workers=MAX_EVALUACIONES_PARALELAS,
+    thread_name_prefix='gemini-eval'
+)
+
+# Generación dividida: reparte un cuestionario en varias llamadas más cortas
+# (una por tipo de pregunta) que se ejecutan en paralelo
+GENERACION_DIVIDIDA = os.getenv('GEMINI_GENERACION_DIVIDIDA', '0') == '1'
+_pool_generacion = ThreadPoolExecutor(
+    max_workers=int(os.getenv('GEMINI_MAX_GENERACIONES_PARALELAS', '6')),
+    thread_name_prefix='gemini-gen'
+)
+
+TIPOS_PREGUNTA = ("opcion_multiple", "verdadero_falso", "respuesta_abierta")
+
+# Plazos (segundos) por llamada a Gemini
+PLAZO_GENERACION = float(os.getenv('GEMINI_PLAZO_GENERACION', '45'))
+PLAZO_EVALUACION = float(os.getenv('GEMINI_PLAZO_EVALUACION', '15'))
+
+# Estado de salud de Gemini compartido por todo el proceso
+_circuito = CircuitBreaker()
+
+# Modo de evaluación de respuestas abiertas: "paralelo" (una llamada por
+# pregunta, concurrentes) o "lote" (una sola llamada para todo el cuestionario)
+MODO_EVALUACION = os.getenv('GEMINI_MODO_EVALUACION', 'paralelo')
+
+# Instancia compartida por proceso (ver obtener_servicio_gemini)
+_servicio_compartido = None
+_servicio_config = None
+_servicio_lock = threading.Lock()
+
+
+def _leer_config_gemini():
+    """Lee la configuración actual de Gemini desde las variables de entorno"""
+    return (os.getenv('GEMINI_API_KEY'), os.getenv('GEMINI_MODEL', MODELO_POR_DEFECTO))
+
+
+def obtener_servicio_gemini() -> "GeminiService":
+    """
+    Devuelve el GeminiService compartido del proceso, creándolo la primera vez.
+
+    El cliente (y su canal gRPC con keep-alive) se reutiliza entre peticiones;
+    si cambia GEMINI_API_KEY o GEMINI_MODEL se vuelve a crear.
+    """
+    global _servicio_compartido, _servicio_config
+    config = _leer_config_gemini()
+    servicio = _servicio_compartido
+    if servicio is not None and _servicio_config == config:
+        return servicio
+
+    with _servicio_lock:
+        if _servicio_compartido is None or _servicio_config != config:
+            _servicio_compartido = GeminiService(api_key=config[0], modelo=config[1])
+            _servicio_config = config
+        return _servicio_compartido
+
+
+def reiniciar_servicio_gemini():
+    """Descarta la instancia compartida; la siguiente llamada crea una nueva"""
+    global _servicio_compartido, _servicio_config
+    with _servicio_lock:
+        _servicio_compartido = None
+        _servicio_config = None
+
 
 class GeminiService:
-    def __init__(self):
+    def __init__(self, api_key: Optional[str] = None, modelo: Optional[str] = None):
         """Inicializa el servicio de Gemini"""
-        self.api_key = os.getenv('GEMINI_API_KEY')
+        self.api_key = api_key or os.getenv('GEMINI_API_KEY')
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY no está configurada en las variables de entorno")
         
-        genai.configure(api_key=self.api_key)
+        # gRPC mantiene la conexión abierta entre llamadas
+        genai.configure(api_key=self.api_key, transport='grpc')
         # Usar el modelo más reciente disponible
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.modelo = modelo or os.getenv('GEMINI_MODEL', MODELO_POR_DEFECTO)
+        self.model = genai.GenerativeModel(self.modelo)
+        # Generaciones idénticas concurrentes comparten una sola llamada
+        self._generaciones = VueloUnico()
+        # Prioridad de cada generación en curso: sube si se suma una petición más urgente
+        self._prioridades: Dict[tuple, list] = {}
+        self._lock_prioridades = threading.Lock()
+        # Y también las evaluaciones de una misma respuesta abierta
+        self._evaluaciones = VueloUnico()
+        # Llamadas con plazo, cobertura, reintentos y circuit breaker; se
+        # separan porque generar y evaluar tienen latencias muy distintas
+        # (sin timeout_transporte: google-generativeai 0.3.2 no admite request_options)
+        self._invocador_generacion = InvocadorResiliente(_circuito, PLAZO_GENERACION)
+        self._invocador_evaluacion = InvocadorResiliente(_circuito, PLAZO_EVALUACION)
     
-    def generar_preguntas(self, tema: str, nivel_academico: str = "universidad", cantidad: int = 10) -> List[Dict[str, Any]]:
+    def disponible(self) -> bool:
+        """Indica si Gemini se considera sano (circuit breaker no abierto)"""
+        return _circuito.estado != CircuitBreaker.ABIERTO
+    
+    def estado(self) -> Dict[str, Any]:
+        """Estado del circuito y del limitador de concurrencia (cola y esperas)"""
+        return {
+            "modelo": self.modelo,
+            "circuito": _circuito.estado,
+            "limitador": limitador_gemini.estadisticas(),
+            "calificacion_lexica": calificador_lexico.estadisticas(),
+            "cache_evaluaciones": cache_evaluaciones.estadisticas()
+        }
+    
+    def generar_preguntas(self, tema: str, nivel_academico: str = "universidad", cantidad: int = 10,
+                          dividir: Optional[bool] = None,
+                          prioridad: int = PRIORIDAD_GENERACION) -> List[Dict[str, Any]]:
         """
         Genera preguntas dinámicas sobre un tema específico adaptadas al nivel académico
         
@@ -27,24 +139,215 @@ class GeminiService:
             tema: El tema de estudio
             nivel_academico: Nivel académico del estudiante (bachillerato, universidad, postgrado)
             cantidad: Número de preguntas a generar
+            dividir: Repartir la generación en llamadas paralelas por tipo
+                     (por defecto GEMINI_GENERACION_DIVIDIDA)
+            prioridad: Prioridad de las llamadas en el limitador de concurrencia
             
         Returns:
             Lista de diccionarios con preguntas, opciones, respuestas correctas y explicaciones
+        
+        Si llegan varias peticiones idénticas a la vez (p. ej. toda una clase abre
+        el mismo tema), solo una llama a Gemini y cada una recibe su propia copia
+        con las preguntas en distinto orden.
+        """
+        if dividir is None:
+            dividir = GENERACION_DIVIDIDA
+        
+        clave = (tema, nivel_academico.lower(), cantidad, dividir)
+        with self._lock_prioridades:
+            entrada = self._prioridades.get(clave)
+            if entrada is None:
+                entrada = self._prioridades[clave] = [PrioridadDinamica(prioridad), 0]
+            else:
+                # Una petición del usuario que se suma a una precarga no espera como precarga
+                entrada[0].elevar(prioridad)
+            entrada[1] += 1
+        try:
+            preguntas, compartido = self._generaciones.ejecutar(
+                clave, self._generar_preguntas, tema, nivel_academico, cantidad, dividir, entrada[0]
+            )
+        finally:
+            with self._lock_prioridades:
+                entrada[1] -= 1
+                if entrada[1] == 0:
+                    del self._prioridades[clave]
+        if compartido:
+            print(f"Generación compartida con otra petición en curso para '{tema}'")
+        
+        # Copia independiente y mezclada para cada solicitante
+        copia = copy.deepcopy(preguntas)
+        random.shuffle(copia)
+        for i, p in enumerate(copia, start=1):
+            p["id"] = i
+        return copia
+    
+    def _generar_preguntas(self, tema: str, nivel_academico: str, cantidad: int,
+                           dividir: bool, prioridad: Union[int, PrioridadDinamica]) -> List[Dict[str, Any]]:
+        """Genera las preguntas sin coalescer (ver generar_preguntas)"""
+        if dividir and cantidad >= len(TIPOS_PREGUNTA):
+            return self._generar_preguntas_divididas(tema, nivel_academico, cantidad, prioridad)
+        
+        prompt = self._prompt_preguntas(tema, nivel_academico, cantidad)
+        
+        try:
+            preguntas = self._solicitar_preguntas(prompt, prioridad)
+            return self._consolidar_preguntas(tema, preguntas, cantidad)
+            
+        except Exception as e:
+            print(f"Error generando preguntas: {e}")
+            print(f"Tipo de error: {type(e).__name__}")
+            # Preguntas de fallback en caso de error
+            return self._preguntas_fallback(tema, cantidad)
+    
+    def _generar_preguntas_divididas(self, tema: str, nivel_academico: str, cantidad: int,
+                                     prioridad: Union[int, PrioridadDinamica]) -> List[Dict[str, Any]]:
+        """
+        Genera el cuestionario con una llamada paralela por tipo de pregunta
+        
+        Cada llamada produce menos texto, así que el tiempo total se acerca al
+        de la llamada más corta en lugar del de una sola respuesta larga.
+        """
+        # Repartir la cantidad entre los tipos (el resto, de a una, a los primeros tipos de la lista)
+        base, resto = divmod(cantidad, len(TIPOS_PREGUNTA))
+        reparto = [(tipo, base + (1 if i < resto else 0)) for i, tipo in enumerate(TIPOS_PREGUNTA)]
+        
+        futuros = [
+            (tipo, _pool_generacion.submit(
+                self._solicitar_preguntas,
+                self._prompt_preguntas(tema, nivel_academico, n, tipo=tipo),
+                prioridad
+            ))
+            for tipo, n in reparto if n > 0
+        ]
+        
+        partes = []
+        for tipo, futuro in futuros:
+            try:
+                partes.append(futuro.result())
+            except Exception as e:
+                print(f"Error generando preguntas de tipo {tipo}: {e}")
+                partes.append([])
+        
+        if not any(partes):
+            return self._preguntas_fallback(tema, cantidad)
+        
+        # Intercalar los tipos para que el cuestionario quede variado
+        preguntas = []
+        for i in range(max(len(parte) for parte in partes)):
+            preguntas.extend(parte[i] for parte in partes if i < len(parte))
+        
+        return self._consolidar_preguntas(tema, preguntas, cantidad)
+    
+    def _solicitar_preguntas(self, prompt: str,
+                             prioridad: Union[int, PrioridadDinamica] = PRIORIDAD_GENERACION) -> List[Dict[str, Any]]:
+        """Envía un prompt de generación a Gemini y devuelve la lista parseada"""
+        print("Enviando prompt a Gemini...")
+        response = self._invocador_generacion.invocar(self.model.generate_content, prompt, prioridad=prioridad)
+        print("Respuesta recibida de Gemini")
+        
+        content = response.text.strip()
+        print(f"Contenido crudo: {content[:200]}...")
+        
+        # El arreglo puede venir rodeado de texto o truncado: se usan las preguntas completas y válidas
+        preguntas = extraer_objetos(content, es_pregunta_valida)
+        if not preguntas:
+            raise ValueError("La respuesta de Gemini no contiene preguntas válidas")
+        print(f"JSON parseado correctamente: {len(preguntas)} preguntas")
+        return preguntas
+    
+    def generar_preguntas_stream(self, tema: str, nivel_academico: str = "universidad",
+                                 cantidad: int = 10) -> Iterator[Dict[str, Any]]:
+        """
+        Genera preguntas en streaming, entregando cada una apenas está completa
+        
+        Usa la generación en streaming de Gemini y extrae los objetos del arreglo
+        JSON a medida que llegan. Si al terminar faltan preguntas (o hubo un error)
+        se completa con el fallback.
+        
+        Yields:
+            Preguntas con ids consecutivos, en orden de llegada
         """
+        prompt = self._prompt_preguntas(tema, nivel_academico, cantidad)
+        emitidas = []
+        vistos = set()
+        
+        try:
+            print("Enviando prompt a Gemini (streaming)...")
+            extractor = ExtractorObjetosJSON(validar=es_pregunta_valida)
+            chunks = self._invocador_generacion.iterar(self.model.generate_content, prompt, stream=True)
+            for chunk in chunks:
+                for p in extractor.alimentar(chunk.text):
+                    enunciado = str(p.get("pregunta", "")).strip().casefold()
+                    if not enunciado or enunciado in vistos or len(emitidas) >= cantidad:
+                        continue
+                    vistos.add(enunciado)
+                    p["id"] = len(emitidas) + 1
+                    emitidas.append(p)
+                    yield p
+            print(f"Streaming terminado: {len(emitidas)} preguntas")
+        except Exception as e:
+            print(f"Error generando preguntas en streaming: {e}")
+            print(f"Tipo de error: {type(e).__name__}")
+        
+        # Completar con fallback las preguntas que falten
+        if len(emitidas) < cantidad:
+            completas = self._consolidar_preguntas(tema, list(emitidas), cantidad)
+            for p in completas[len(emitidas):]:
+                yield p
+    
+    def _consolidar_preguntas(self, tema: str, preguntas: List[Dict[str, Any]], cantidad: int) -> List[Dict[str, Any]]:
+        """Deduplica, completa con fallback y renumera las preguntas generadas"""
+        # Deduplicar por enunciado de la pregunta (casefold y strip)
+        preguntas_unicas = []
+        vistos = set()
+        for p in preguntas:
+            enunciado = str(p.get("pregunta", "")).strip().casefold()
+            if enunciado and enunciado not in vistos:
+                vistos.add(enunciado)
+                preguntas_unicas.append(p)
+
+        # Completar con fallback si faltan preguntas
+        if len(preguntas_unicas) < cantidad:
+            faltantes = cantidad - len(preguntas_unicas)
+            fallback = self._preguntas_fallback(tema, faltantes)
+            for p in fallback:
+                enunciado = str(p.get("pregunta", "")).strip().casefold()
+                if enunciado and enunciado not in vistos:
+                    vistos.add(enunciado)
+                    preguntas_unicas.append(p)
+                if len(preguntas_unicas) >= cantidad:
+                    break
+
+        # Limitar a la cantidad solicitada y normalizar ids
+        preguntas_unicas = preguntas_unicas[:cantidad]
+        for i, p in enumerate(preguntas_unicas, start=1):
+            p["id"] = i
+
+        return preguntas_unicas
+    
+    def _prompt_preguntas(self, tema: str, nivel_academico: str, cantidad: int,
+                          tipo: Optional[str] = None) -> str:
+        """Construye el prompt de generación de preguntas (opcionalmente de un solo tipo)"""
         # Definir nivel de complejidad según nivel académico
         nivel_info = self._obtener_info_nivel(nivel_academico)
         
-        prompt = f"""
+        if tipo:
+            tipos = f"""TODAS las preguntas deben ser de tipo "{tipo}" (usa solo ese formato
+        de los ejemplos de abajo)."""
+        else:
+            tipos = """Los tipos de preguntas deben ser variados:
+        - Opción múltiple (4 opciones A, B, C, D)
+        - Verdadero/Falso
+        - Respuesta abierta (para explicaciones conceptuales)"""
+        
+        return f"""
         Genera {cantidad} preguntas educativas sobre el tema: "{tema}"
         
         NIVEL ACADÉMICO: {nivel_academico.upper()}
         COMPLEJIDAD: {nivel_info['complejidad']}
         ENFOQUE: {nivel_info['enfoque']}
         
-        Los tipos de preguntas deben ser variados:
-        - Opción múltiple (4 opciones A, B, C, D)
-        - Verdadero/Falso
-        - Respuesta abierta (para explicaciones conceptuales)
+        {tipos}
         
         CRITERIOS IMPORTANTES:
         - Adapta la complejidad al nivel {nivel_academico}
@@ -94,58 +397,6 @@ class GeminiService:
         - Las explicaciones deben ser educativas y claras
         - No incluyas texto adicional fuera del JSON
         """
-        
-        try:
-            print(f"Enviando prompt a Gemini...")
-            response = self.model.generate_content(prompt)
-            print(f"Respuesta recibida de Gemini")
-            
-            # Limpiar la respuesta para extraer solo el JSON
-            content = response.text.strip()
-            print(f"Contenido crudo: {content[:200]}...")
-            
-            # Buscar el JSON en la respuesta
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.endswith('```'):
-                content = content[:-3]
-            
-            preguntas = json.loads(content)
-            print(f"JSON parseado correctamente: {len(preguntas)} preguntas")
-
-            # Deduplicar por enunciado de la pregunta (casefold y strip)
-            preguntas_unicas = []
-            vistos = set()
-            for p in preguntas:
-                enunciado = str(p.get("pregunta", "")).strip().casefold()
-                if enunciado and enunciado not in vistos:
-                    vistos.add(enunciado)
-                    preguntas_unicas.append(p)
-
-            # Completar con fallback si faltan preguntas
-            if len(preguntas_unicas) < cantidad:
-                faltantes = cantidad - len(preguntas_unicas)
-                fallback = self._preguntas_fallback(tema, faltantes)
-                for p in fallback:
-                    enunciado = str(p.get("pregunta", "")).strip().casefold()
-                    if enunciado and enunciado not in vistos:
-                        vistos.add(enunciado)
-                        preguntas_unicas.append(p)
-                    if len(preguntas_unicas) >= cantidad:
-                        break
-
-            # Limitar a la cantidad solicitada y normalizar ids
-            preguntas_unicas = preguntas_unicas[:cantidad]
-            for i, p in enumerate(preguntas_unicas, start=1):
-                p["id"] = i
-
-            return preguntas_unicas
-            
-        except Exception as e:
-            print(f"Error generando preguntas: {e}")
-            print(f"Tipo de error: {type(e).__name__}")
-            # Preguntas de fallback en caso de error
-            return self._preguntas_fallback(tema, cantidad)
     
     def evaluar_respuesta(self, pregunta: Dict[str, Any], respuesta_usuario: str) -> Dict[str, Any]:
         """
@@ -167,48 +418,240 @@ class GeminiService:
                 "explicacion": pregunta["explicacion"]
             }
         
+        elif pregunta["tipo"] == "respuesta_numerica":
+            # Numéricas: comparación local con tolerancia, sin Gemini
+            return calificar_lote([pregunta], [respuesta_usuario])[0]
+        
         elif pregunta["tipo"] == "respuesta_abierta":
-            # Para respuestas abiertas, usar Gemini para evaluar
-            prompt = f"""
-            Evalúa la siguiente respuesta a una pregunta educativa:
-            
-            PREGUNTA: {pregunta['pregunta']}
-            RESPUESTA CORRECTA ESPERADA: {pregunta['respuesta_correcta']}
-            RESPUESTA DEL USUARIO: {respuesta_usuario}
+            # Los casos claros y las respuestas ya evaluadas no llaman a Gemini
+            evaluacion = self._evaluar_abierta_local(pregunta, respuesta_usuario)
+            if evaluacion is not None:
+                return evaluacion
+            return self._evaluar_abierta_gemini(pregunta, respuesta_usuario)
+    
+    @staticmethod
+    def _evaluar_abierta_local(pregunta: Dict[str, Any], respuesta_usuario: str) -> Optional[Dict[str, Any]]:
+        """Calificador léxico y, si no decide, caché de evaluaciones anteriores"""
+        evaluacion = calificar_abierta(pregunta, respuesta_usuario)
+        if evaluacion is None:
+            evaluacion = cache_evaluaciones.obtener(pregunta, respuesta_usuario)
+        return evaluacion
+    
+    def _evaluar_abierta_gemini(self, pregunta: Dict[str, Any], respuesta_usuario: str) -> Dict[str, Any]:
+        """Evalúa una respuesta abierta con Gemini y guarda el resultado en la caché"""
+        # Respuestas idénticas que llegan a la vez comparten la llamada
+        clave = clave_evaluacion(pregunta, respuesta_usuario)
+        try:
+            evaluacion, _ = self._evaluaciones.ejecutar(
+                clave, self._solicitar_evaluacion, pregunta, respuesta_usuario
+            )
+        except Exception as e:
+            # Los errores no se guardan en la caché: la próxima vez se reintenta
+            print(f"Error evaluando respuesta: {e}")
+            return {
+                "correcta": False,
+                "puntaje": 0,
+                "explicacion": "Error en la evaluación automática"
+            }
+        cache_evaluaciones.guardar(pregunta, respuesta_usuario, evaluacion)
+        return dict(evaluacion)
+    
+    def _solicitar_evaluacion(self, pregunta: Dict[str, Any], respuesta_usuario: str) -> Dict[str, Any]:
+        """Llamada a Gemini para evaluar una respuesta abierta (lanza excepción si falla)"""
+        prompt = f"""
+        Evalúa la siguiente respuesta a una pregunta educativa:
+        
+        PREGUNTA: {pregunta['pregunta']}
+        RESPUESTA CORRECTA ESPERADA: {pregunta['respuesta_correcta']}
+        RESPUESTA DEL USUARIO: {respuesta_usuario}
+        
+        Evalúa la respuesta del usuario considerando:
+        1. Precisión conceptual
+        2. Completitud de la respuesta
+        3. Uso de terminología apropiada
+        
+        Responde ÚNICAMENTE en formato JSON:
+        {{
+            "correcta": true/false,
+            "puntaje": 0.0-1.0,
+            "explicacion": "Explicación detallada de la evaluación"
+        }}
+        """
+        
+        response = self._invocador_evaluacion.invocar(
+            self.model.generate_content, prompt, prioridad=PRIORIDAD_EVALUACION
+        )
+        evaluacion = extraer_objeto(response.text, lambda e: self._es_evaluacion_valida(e, con_id=False))
+        if evaluacion is None:
+            raise ValueError("La respuesta de Gemini no contiene una evaluación válida")
+        return evaluacion
+    
+    def evaluar_cuestionario(self, preguntas: List[Dict[str, Any]], respuestas_usuario: Dict[str, str],
+                             modo: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Evalúa todas las respuestas de un cuestionario
+        
+        Las preguntas cerradas se comparan directamente y las numéricas se
+        califican todas juntas en una pasada local. Las de respuesta abierta
+        que el calificador léxico no puede decidir y que no están en la caché
+        se evalúan con Gemini en paralelo (pool acotado), de modo que la latencia
+        total es la de la llamada más lenta y no la suma de todas, o bien en una
+        única llamada si el modo es "lote".
+        
+        Args:
+            preguntas: Lista de preguntas del cuestionario
+            respuestas_usuario: Respuestas del usuario indexadas por id de pregunta
+            modo: "paralelo" o "lote" (por defecto GEMINI_MODO_EVALUACION)
             
-            Evalúa la respuesta del usuario considerando:
-            1. Precisión conceptual
-            2. Completitud de la respuesta
-            3. Uso de terminología apropiada
+        Returns:
+            Lista de evaluaciones en el mismo orden que las preguntas
+        """
+        modo = modo or MODO_EVALUACION
+        evaluaciones = [None] * len(preguntas)
+        pendientes = {}
+        abiertas = []
+        numericas = []
+        
+        for i, pregunta in enumerate(preguntas):
+            respuesta = respuestas_usuario.get(str(pregunta['id']), '')
+            if pregunta["tipo"] == "respuesta_numerica":
+                numericas.append((i, pregunta, respuesta))
+            elif pregunta["tipo"] != "respuesta_abierta":
+                evaluaciones[i] = self.evaluar_respuesta(pregunta, respuesta)
+            else:
+                # Los casos claros y los ya evaluados se resuelven localmente
+                evaluaciones[i] = self._evaluar_abierta_local(pregunta, respuesta)
+                if evaluaciones[i] is not None:
+                    continue
+                if modo == "lote":
+                    abiertas.append((i, pregunta, respuesta))
+                else:
+                    pendientes[i] = _pool_evaluacion.submit(self._evaluar_abierta_gemini, pregunta, respuesta)
+        
+        if numericas:
+            resultados = calificar_lote([p for _, p, _ in numericas], [r for _, _, r in numericas])
+            for (i, _, _), evaluacion in zip(numericas, resultados):
+                evaluaciones[i] = evaluacion
+        
+        if abiertas:
+            resultados = self.evaluar_respuestas_lote([(p, r) for _, p, r in abiertas])
+            for (i, _, _), evaluacion in zip(abiertas, resultados):
+                evaluaciones[i] = evaluacion
+        
+        for i, futuro in pendientes.items():
+            try:
+                evaluaciones[i] = futuro.result()
+            except Exception as e:
+                print(f"Error evaluando respuesta: {e}")
+                evaluaciones[i] = None
+        
+        # Tipos desconocidos (o errores inesperados) no deben romper la evaluación
+        for i, evaluacion in enumerate(evaluaciones):
+            if evaluacion is None:
+                evaluaciones[i] = {
+                    "correcta": False,
+                    "puntaje": 0,
+                    "explicacion": "Error en la evaluación automática"
+                }
+        
+        return evaluaciones
+    
+    def evaluar_respuestas_lote(self, items: List[tuple]) -> List[Dict[str, Any]]:
+        """
+        Evalúa varias respuestas abiertas con una sola llamada a Gemini
+        
+        Si la respuesta del lote no es válida, o falta alguna evaluación, esas
+        preguntas se evalúan individualmente (en paralelo) como respaldo.
+        
+        Args:
+            items: Lista de tuplas (pregunta, respuesta_usuario)
             
-            Responde ÚNICAMENTE en formato JSON:
+        Returns:
+            Lista de evaluaciones en el mismo orden que los items
+        """
+        if not items:
+            return []
+        
+        entradas = [
+            {
+                "id": str(pregunta["id"]),
+                "pregunta": pregunta["pregunta"],
+                "respuesta_correcta_esperada": pregunta["respuesta_correcta"],
+                "respuesta_usuario": respuesta
+            }
+            for pregunta, respuesta in items
+        ]
+        
+        prompt = f"""
+        Evalúa las siguientes respuestas a preguntas educativas:
+        
+        {json.dumps(entradas, ensure_ascii=False, indent=2)}
+        
+        Para cada respuesta considera:
+        1. Precisión conceptual
+        2. Completitud de la respuesta
+        3. Uso de terminología apropiada
+        
+        Responde ÚNICAMENTE con un arreglo JSON, un elemento por cada "id":
+        [
             {{
+                "id": "id de la pregunta",
                 "correcta": true/false,
                 "puntaje": 0.0-1.0,
                 "explicacion": "Explicación detallada de la evaluación"
             }}
-            """
-            
+        ]
+        """
+        
+        por_id = {}
+        try:
+            response = self._invocador_evaluacion.invocar(
+                self.model.generate_content, prompt, prioridad=PRIORIDAD_EVALUACION
+            )
+            # Si la respuesta llegó truncada se aprovechan las evaluaciones completas
+            for evaluacion in extraer_objetos(response.text, self._es_evaluacion_valida):
+                por_id[str(evaluacion["id"])] = {
+                    "correcta": evaluacion["correcta"],
+                    "puntaje": evaluacion["puntaje"],
+                    "explicacion": evaluacion["explicacion"]
+                }
+        except Exception as e:
+            print(f"Error evaluando respuestas en lote: {e}")
+        
+        evaluaciones = [por_id.get(str(pregunta["id"])) for pregunta, _ in items]
+        for (pregunta, respuesta), evaluacion in zip(items, evaluaciones):
+            if evaluacion is not None:
+                cache_evaluaciones.guardar(pregunta, respuesta, evaluacion)
+        
+        # Respaldo individual para las evaluaciones que faltan o son inválidas
+        faltantes = {
+            i: _pool_evaluacion.submit(self._evaluar_abierta_gemini, pregunta, respuesta)
+            for i, (pregunta, respuesta) in enumerate(items)
+            if evaluaciones[i] is None
+        }
+        if faltantes:
+            print(f"Evaluación en lote incompleta: {len(faltantes)} respuestas se evalúan por separado")
+        for i, futuro in faltantes.items():
             try:
-                response = self.model.generate_content(prompt)
-                content = response.text.strip()
-                
-                # Limpiar la respuesta
-                if content.startswith('```json'):
-                    content = content[7:]
-                if content.endswith('```'):
-                    content = content[:-3]
-                
-                evaluacion = json.loads(content)
-                return evaluacion
-                
+                evaluaciones[i] = futuro.result()
             except Exception as e:
                 print(f"Error evaluando respuesta: {e}")
-                return {
-                    "correcta": False,
-                    "puntaje": 0,
-                    "explicacion": "Error en la evaluación automática"
-                }
+        
+        return evaluaciones
+    
+    @staticmethod
+    def _es_evaluacion_valida(evaluacion: Any, con_id: bool = True) -> bool:
+        """Comprueba que una evaluación tenga los campos esperados (el id solo en las del lote)"""
+        if not isinstance(evaluacion, dict):
+            return False
+        campos = ("id", "correcta", "puntaje", "explicacion") if con_id else ("correcta", "puntaje", "explicacion")
+        if not all(k in evaluacion for k in campos):
+            return False
+        # "correcta": "false" no es una evaluación válida (bool("false") es True)
+        if not isinstance(evaluacion["correcta"], bool) or not isinstance(evaluacion["explicacion"], str):
+            return False
+        puntaje = evaluacion["puntaje"]
+        return isinstance(puntaje, (int, float)) and not isinstance(puntaje, bool) and 0 <= puntaje <= 1
     
     def _obtener_info_nivel(self, nivel_academico: str) -> Dict[str, str]:
         """Obtiene información específica según el nivel académico"""
@@ -235,12 +678,33 @@ class GeminiService:
         
         return niveles.get(nivel_academico.lower(), niveles["universidad"])
     
+    def es_pregunta_fallback(self, tema: str, pregunta: Dict[str, Any]) -> bool:
+        """Indica si la pregunta proviene del conjunto estático de fallback"""
+        enunciado = str(pregunta.get("pregunta", "")).strip().casefold()
+        return enunciado in {
+            p["pregunta"].strip().casefold()
+            for p in self._preguntas_base_fallback(tema)
+        }
+    
     def _preguntas_fallback(self, tema: str, cantidad: int) -> List[Dict[str, Any]]:
         """Preguntas de fallback en caso de error con Gemini"""
         print("ADVERTENCIA: Usando preguntas de fallback - Gemini no disponible")
         
+        preguntas_base = self._preguntas_base_fallback(tema)
+        
+        # Repetir preguntas hasta alcanzar la cantidad deseada
+        preguntas = []
+        for i in range(cantidad):
+            pregunta = preguntas_base[i % len(preguntas_base)].copy()
+            pregunta["id"] = i + 1
+            preguntas.append(pregunta)
+        
+        return preguntas
+    
+    def _preguntas_base_fallback(self, tema: str) -> List[Dict[str, Any]]:
+        """Preguntas estáticas usadas como fallback"""
         # Preguntas estáticas más realistas
-        preguntas_base = [
+        return [
             {
                 "id": 1,
                 "tipo": "opcion_multiple",
@@ -274,12 +738,3 @@ class GeminiService:
                 "explicacion": "La mediana es más útil cuando los datos tienen valores extremos porque no se ve afectada por ellos, a diferencia de la media que puede distorsionarse."
             }
         ]
-        
-        # Repetir preguntas hasta alcanzar la cantidad deseada
-        preguntas = []
-        for i in range(cantidad):
-            pregunta = preguntas_base[i % len(preguntas_base)].copy()
-            pregunta["id"] = i + 1
-            preguntas.append(pregunta)
-        
-        return preguntas
@@ -0,0 +1,203 @@
+"""
+Control de admisión para las llamadas a Gemini
+Limita cuántas llamadas hay en curso a la vez en el proceso y, cuando se
+alcanza el límite, atiende primero las de mayor prioridad
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Union
+
+# Menor número = mayor prioridad
+PRIORIDAD_EVALUACION = 0
+PRIORIDAD_GENERACION = 1
+PRIORIDAD_PRECARGA = 2
+
+NOMBRES_PRIORIDAD = {
+    PRIORIDAD_EVALUACION: "evaluacion",
+    PRIORIDAD_GENERACION: "generacion",
+    PRIORIDAD_PRECARGA: "precarga",
+}
+
+
+class ColaAgotadaError(Exception):
+    """Se lanza cuando una llamada no consigue turno antes de su plazo"""
+
+
+class _Espera:
+    def __init__(self, prioridad: int):
+        self.prioridad = prioridad
+        self.evento = threading.Event()
+        self.admitida = False
+        self.cancelada = False
+
+
+class PrioridadDinamica:
+    """
+    Prioridad compartida por las llamadas de un trabajo que puede subir
+    mientras esperan turno (p. ej. cuando una petición del usuario se suma
+    a una precarga en curso)
+    """
+
+    def __init__(self, valor: int):
+        self.valor = valor
+        self._esperas = set()
+        self._lock = threading.Lock()
+
+    def elevar(self, valor: int):
+        """Sube la prioridad (menor número) de este trabajo y de sus llamadas en cola"""
+        with self._lock:
+            if valor >= self.valor:
+                return
+            self.valor = valor
+            esperas = list(self._esperas)
+        for limitador, espera in esperas:
+            limitador._reordenar(espera, valor)
+
+    def _registrar(self, limitador: "LimitadorConcurrencia", espera: _Espera):
+        with self._lock:
+            self._esperas.add((limitador, espera))
+        # Pudo haber subido entre el encolado y el registro
+        limitador._reordenar(espera, self.valor)
+
+    def _quitar(self, limitador: "LimitadorConcurrencia", espera: _Espera):
+        with self._lock:
+            self._esperas.discard((limitador, espera))
+
+
+class LimitadorConcurrencia:
+    def __init__(self, maximo: int):
+        """
+        Args:
+            maximo: Llamadas simultáneas permitidas
+        """
+        self.maximo = maximo
+        self._en_uso = 0
+        self._cola = []
+        self._secuencia = itertools.count()
+        self._lock = threading.Lock()
+        # Estadísticas de espera por prioridad
+        self._admitidas = {p: 0 for p in NOMBRES_PRIORIDAD}
+        self._espera_total = {p: 0.0 for p in NOMBRES_PRIORIDAD}
+        self._espera_maxima = {p: 0.0 for p in NOMBRES_PRIORIDAD}
+        self._rechazadas = 0
+
+    @contextmanager
+    def admitir(self, prioridad: Union[int, PrioridadDinamica] = PRIORIDAD_GENERACION,
+                timeout: Optional[float] = None):
+        """
+        Espera turno para hacer una llamada y lo libera al salir del bloque
+
+        `prioridad` puede ser una PrioridadDinamica: si sube mientras la
+        llamada espera, la llamada avanza en la cola.
+
+        Raises:
+            ColaAgotadaError: si no hay turno antes de `timeout` segundos
+        """
+        self.adquirir(prioridad, timeout)
+        try:
+            yield
+        finally:
+            self.liberar()
+
+    def adquirir(self, prioridad: Union[int, PrioridadDinamica] = PRIORIDAD_GENERACION,
+                 timeout: Optional[float] = None):
+        dinamica = prioridad if isinstance(prioridad, PrioridadDinamica) else None
+        valor = dinamica.valor if dinamica else prioridad
+        inicio = time.monotonic()
+        with self._lock:
+            self._descartar_vencidas()
+            if self._en_uso < self.maximo and not self._cola:
+                self._en_uso += 1
+                self._registrar_espera(valor, 0.0)
+                return
+            espera = _Espera(valor)
+            heapq.heappush(self._cola, (valor, next(self._secuencia), espera))
+
+        if dinamica:
+            dinamica._registrar(self, espera)
+        try:
+            espera.evento.wait(None if timeout is None else max(timeout, 0))
+        finally:
+            if dinamica:
+                dinamica._quitar(self, espera)
+
+        with self._lock:
+            if not espera.admitida:
+                # Se marca y se descarta al llegar a la cabeza de la cola
+                espera.cancelada = True
+                self._rechazadas += 1
+                raise ColaAgotadaError("No hubo turno para llamar a Gemini dentro del plazo")
+            self._registrar_espera(espera.prioridad, time.monotonic() - inicio)
+
+    def liberar(self):
+        with self._lock:
+            # El turno pasa directamente al siguiente en espera de mayor prioridad
+            while self._cola:
+                _, _, espera = heapq.heappop(self._cola)
+                if not espera.cancelada and not espera.admitida:
+                    espera.admitida = True
+                    espera.evento.set()
+                    return
+            self._en_uso -= 1
+
+    def _descartar_vencidas(self):
+        """Quita de la cabeza las entradas canceladas, ya admitidas o reemplazadas al subir de prioridad"""
+        while self._cola:
+            prioridad, _, espera = self._cola[0]
+            if not espera.cancelada and not espera.admitida and prioridad == espera.prioridad:
+                return
+            heapq.heappop(self._cola)
+
+    def _reordenar(self, espera: _Espera, prioridad: int):
+        """Sube una llamada en cola a `prioridad` (la entrada vieja se descarta al salir)"""
+        with self._lock:
+            if espera.admitida or espera.cancelada or prioridad >= espera.prioridad:
+                return
+            espera.prioridad = prioridad
+            heapq.heappush(self._cola, (prioridad, next(self._secuencia), espera))
+
+    def hay_capacidad(self) -> bool:
+        """Indica si hay turnos libres sin nadie esperando"""
+        with self._lock:
+            self._descartar_vencidas()
+            return self._en_uso < self.maximo and not self._cola
+
+    def _registrar_espera(self, prioridad: int, segundos: float):
+        if prioridad not in self._admitidas:
+            return
+        self._admitidas[prioridad] += 1
+        self._espera_total[prioridad] += segundos
+        self._espera_maxima[prioridad] = max(self._espera_maxima[prioridad], segundos)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """Ocupación, profundidad de la cola y tiempos de espera por prioridad"""
+        with self._lock:
+            en_cola = {nombre: 0 for nombre in NOMBRES_PRIORIDAD.values()}
+            for prioridad, _, espera in self._cola:
+                # Las entradas que quedaron atrás al subir de prioridad no se cuentan
+                if not espera.cancelada and not espera.admitida and prioridad == espera.prioridad:
+                    nombre = NOMBRES_PRIORIDAD.get(prioridad, str(prioridad))
+                    en_cola[nombre] = en_cola.get(nombre, 0) + 1
+            return {
+                "maximo": self.maximo,
+                "en_uso": self._en_uso,
+                "en_cola": en_cola,
+                "rechazadas": self._rechazadas,
+                "espera": {
+                    nombre: {
+                        "admitidas": self._admitidas[p],
+                        "media_segundos": round(self._espera_total[p] / self._admitidas[p], 4) if self._admitidas[p] else 0.0,
+                        "maxima_segundos": round(self._espera_maxima[p], 4)
+                    }
+                    for p, nombre in NOMBRES_PRIORIDAD.items()
+                }
+            }
+
+
+# Límite compartido por todas las llamadas a Gemini del proceso
+limitador_gemini = LimitadorConcurrencia(int(os.getenv('GEMINI_MAX_CONCURRENCIA', '8')))
@@ -0,0 +1,290 @@
+"""
+Capa de llamadas resilientes a Gemini
+Un plazo total por llamada (compartido por los reintentos), solicitud de cobertura (hedging) cuando una llamada
+supera el p95 observado, reintentos con backoff aleatorio y un circuit
+breaker que corta las llamadas mientras el servicio no responde bien.
+Cada llamada pasa además por el limitador de concurrencia con prioridad
+"""
+
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Iterator, Optional, Union
+
+from limitador import ColaAgotadaError, PRIORIDAD_GENERACION, PrioridadDinamica, limitador_gemini
+
+# Hilos que ejecutan las llamadas (una llamada que vence su plazo sigue
+# ocupando su hilo hasta que la librería de Gemini responde, o hasta el
+# timeout de su petición HTTP si se usa timeout_transporte)
+_pool_llamadas = ThreadPoolExecutor(
+    max_workers=int(os.getenv('GEMINI_MAX_HILOS_LLAMADAS', '32')),
+    thread_name_prefix='gemini-llamada'
+)
+
+
+class CircuitoAbiertoError(Exception):
+    """Se lanza cuando el circuit breaker no permite llamar a Gemini"""
+
+
+class PlazoAgotadoError(Exception):
+    """Se lanza cuando una llamada no responde dentro de su plazo"""
+
+
+class CircuitBreaker:
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, umbral_fallos: Optional[int] = None, segundos_abierto: Optional[float] = None):
+        """
+        Args:
+            umbral_fallos: Fallos consecutivos que abren el circuito
+            segundos_abierto: Tiempo que el circuito permanece abierto antes de probar de nuevo
+        """
+        self.umbral_fallos = umbral_fallos or int(os.getenv('GEMINI_CIRCUITO_UMBRAL_FALLOS', '5'))
+        self.segundos_abierto = segundos_abierto or float(os.getenv('GEMINI_CIRCUITO_SEGUNDOS_ABIERTO', '30'))
+        self._estado = self.CERRADO
+        self._fallos = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            if self._estado == self.ABIERTO and time.monotonic() - self._abierto_desde >= self.segundos_abierto:
+                return self.SEMIABIERTO
+            return self._estado
+
+    def permitir(self) -> bool:
+        """Indica si se puede hacer una llamada (en semiabierto, solo una de prueba)"""
+        with self._lock:
+            if self._estado == self.CERRADO:
+                return True
+            if self._estado == self.ABIERTO:
+                if time.monotonic() - self._abierto_desde < self.segundos_abierto:
+                    return False
+                self._estado = self.SEMIABIERTO
+                self._prueba_en_curso = False
+            if self._prueba_en_curso:
+                return False
+            self._prueba_en_curso = True
+            return True
+
+    def cancelar_prueba(self):
+        """Libera la llamada de prueba si se abandonó sin resultado"""
+        with self._lock:
+            self._prueba_en_curso = False
+
+    def registrar_exito(self):
+        with self._lock:
+            self._estado = self.CERRADO
+            self._fallos = 0
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self._estado == self.SEMIABIERTO or self._fallos >= self.umbral_fallos:
+                if self._estado != self.ABIERTO:
+                    print(f"Circuit breaker de Gemini ABIERTO tras {self._fallos} fallos")
+                self._estado = self.ABIERTO
+                self._abierto_desde = time.monotonic()
+                self._prueba_en_curso = False
+
+
+class InvocadorResiliente:
+    def __init__(self, circuito: CircuitBreaker, plazo: float, reintentos: Optional[int] = None,
+                 cobertura: Optional[bool] = None, cobertura_minima: Optional[float] = None,
+                 timeout_transporte: bool = False):
+        """
+        Args:
+            circuito: Circuit breaker compartido
+            plazo: Segundos máximos de la llamada, incluidos los reintentos
+            reintentos: Reintentos tras un fallo (GEMINI_REINTENTOS)
+            cobertura: Lanzar una segunda solicitud si la primera supera el p95 (GEMINI_COBERTURA)
+            cobertura_minima: Segundos mínimos antes de lanzar la cobertura
+            timeout_transporte: Pasar a `funcion` request_options={"timeout": ...} con el
+                tiempo restante, para que la petición HTTP termine al vencer el plazo.
+                Solo si `funcion` acepta ese argumento (generate_content lo admite
+                desde versiones de google-generativeai posteriores a la 0.3.2)
+        """
+        self.circuito = circuito
+        self.plazo = plazo
+        self.timeout_transporte = timeout_transporte
+        self.reintentos = int(os.getenv('GEMINI_REINTENTOS', '2')) if reintentos is None else reintentos
+        self.cobertura = os.getenv('GEMINI_COBERTURA', '1') == '1' if cobertura is None else cobertura
+        self.cobertura_minima = cobertura_minima or plazo / 4
+        self.backoff_base = float(os.getenv('GEMINI_BACKOFF_BASE', '0.5'))
+        self.backoff_maximo = float(os.getenv('GEMINI_BACKOFF_MAXIMO', '8'))
+        self._latencias = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def umbral_cobertura(self) -> float:
+        """Segundos a esperar antes de la solicitud de cobertura (p95 observado)"""
+        with self._lock:
+            muestras = sorted(self._latencias)
+        if len(muestras) < 20:
+            return max(self.cobertura_minima, self.plazo / 2)
+        p95 = muestras[int(len(muestras) * 0.95) - 1]
+        return min(max(p95, self.cobertura_minima), self.plazo)
+
+    def invocar(self, funcion: Callable[..., Any], *args,
+                prioridad: Union[int, PrioridadDinamica] = PRIORIDAD_GENERACION, **kwargs) -> Any:
+        """
+        Ejecuta `funcion` con plazo, cobertura y reintentos
+
+        Todos los intentos comparten el mismo plazo total; si se agota no se
+        reintenta, y la cobertura solo se lanza en el primer intento.
+
+        Args:
+            prioridad: Prioridad en el limitador de concurrencia
+
+        Raises:
+            CircuitoAbiertoError: si el circuito está abierto
+            ColaAgotadaError: si no hubo turno en el limitador dentro del plazo
+            PlazoAgotadoError: si no hubo respuesta dentro del plazo total
+            La última excepción del último intento si todos fallan
+        """
+        limite = time.monotonic() + self.plazo
+        ultimo_error = None
+        for intento in range(self.reintentos + 1):
+            if not self.circuito.permitir():
+                raise CircuitoAbiertoError("Gemini no disponible temporalmente (circuito abierto)")
+
+            try:
+                resultado = self._intentar(funcion, prioridad, limite, intento == 0, *args, **kwargs)
+                self.circuito.registrar_exito()
+                return resultado
+            except ColaAgotadaError:
+                # Saturación local, no un fallo de Gemini: no cuenta para el circuito
+                self.circuito.cancelar_prueba()
+                raise
+            except PlazoAgotadoError as e:
+                # Sin tiempo restante no tiene sentido volver a intentar
+                self.circuito.registrar_fallo()
+                print(f"Llamada a Gemini fallida (intento {intento + 1}): {type(e).__name__}: {e}")
+                raise
+            except Exception as e:
+                ultimo_error = e
+                self.circuito.registrar_fallo()
+                print(f"Llamada a Gemini fallida (intento {intento + 1}): {type(e).__name__}: {e}")
+
+            if intento < self.reintentos:
+                # Backoff exponencial con jitter completo, sin pasarse del plazo
+                espera = random.uniform(0, min(self.backoff_maximo, self.backoff_base * 2 ** intento))
+                if time.monotonic() + espera >= limite:
+                    break
+                time.sleep(espera)
+
+        raise ultimo_error
+
+    def iterar(self, funcion: Callable[..., Any], *args,
+               prioridad: Union[int, PrioridadDinamica] = PRIORIDAD_GENERACION,
+               **kwargs) -> Iterator[Any]:
+        """
+        Recorre una respuesta en streaming respetando el plazo total
+
+        No reintenta ni lanza cobertura (lo ya entregado no se puede deshacer),
+        pero sí consulta y actualiza el circuit breaker.
+        """
+        if not self.circuito.permitir():
+            raise CircuitoAbiertoError("Gemini no disponible temporalmente (circuito abierto)")
+
+        cola = queue.Queue()
+        fin = object()
+        cancelado = threading.Event()
+        limite = time.monotonic() + self.plazo
+
+        def producir():
+            try:
+                # El turno del limitador se mantiene durante todo el streaming
+                with limitador_gemini.admitir(prioridad, timeout=limite - time.monotonic()):
+                    for elemento in funcion(*args, **self._con_timeout(limite, kwargs)):
+                        if cancelado.is_set():
+                            return
+                        cola.put((elemento, None))
+                cola.put((fin, None))
+            except Exception as e:
+                cola.put((fin, e))
+
+        _pool_llamadas.submit(producir)
+        recibidos = 0
+        try:
+            while True:
+                restante = limite - time.monotonic()
+                try:
+                    elemento, error = cola.get(timeout=max(restante, 0))
+                except queue.Empty:
+                    raise PlazoAgotadoError(f"Gemini no terminó el streaming en {self.plazo:g} s")
+                if error is not None:
+                    raise error
+                if elemento is fin:
+                    break
+                recibidos += 1
+                yield elemento
+        except GeneratorExit:
+            # El consumidor dejó de leer (p. ej. el cliente cerró la conexión)
+            cancelado.set()
+            if recibidos:
+                self.circuito.registrar_exito()
+            else:
+                self.circuito.cancelar_prueba()
+            raise
+        except ColaAgotadaError:
+            self.circuito.cancelar_prueba()
+            raise
+        except Exception:
+            cancelado.set()
+            self.circuito.registrar_fallo()
+            raise
+        self.circuito.registrar_exito()
+
+    def _intentar(self, funcion: Callable[..., Any], prioridad: Union[int, PrioridadDinamica], limite: float,
+                  con_cobertura: bool, *args, **kwargs) -> Any:
+        futuros = {_pool_llamadas.submit(self._ejecutar_admitida, limite, prioridad, funcion, *args, **kwargs)}
+
+        # La cobertura solo tiene sentido si hay turnos libres; con el
+        # limitador saturado solo añadiría más espera
+        if self.cobertura and con_cobertura:
+            espera = min(self.umbral_cobertura(), max(limite - time.monotonic(), 0))
+            hecho, _ = wait(futuros, timeout=espera)
+            if not hecho and limite > time.monotonic() and limitador_gemini.hay_capacidad():
+                print("Gemini lento: lanzando solicitud de cobertura")
+                futuros.add(_pool_llamadas.submit(self._ejecutar_admitida, limite, prioridad, funcion, *args, **kwargs))
+
+        ultimo_error = None
+        while futuros:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            hecho, futuros = wait(futuros, timeout=restante, return_when=FIRST_COMPLETED)
+            for futuro in hecho:
+                if futuro.exception() is None:
+                    return futuro.result()
+                ultimo_error = futuro.exception()
+
+        if ultimo_error is not None and not futuros:
+            raise ultimo_error
+        raise PlazoAgotadoError(f"Gemini no respondió en {self.plazo:g} s")
+
+    def _ejecutar_admitida(self, limite: float, prioridad: Union[int, PrioridadDinamica],
+                           funcion: Callable[..., Any], *args, **kwargs) -> Any:
+        """Espera turno en el limitador y ejecuta la llamada midiendo su latencia"""
+        with limitador_gemini.admitir(prioridad, timeout=limite - time.monotonic()):
+            inicio = time.monotonic()
+            resultado = funcion(*args, **self._con_timeout(limite, kwargs))
+            with self._lock:
+                self._latencias.append(time.monotonic() - inicio)
+            return resultado
+
+    def _con_timeout(self, limite: float, kwargs: dict) -> dict:
+        """Añade el tiempo restante como timeout de la petición HTTP (libera el turno al vencer)"""
+        if not self.timeout_transporte:
+            return kwargs
+        restante = max(limite - time.monotonic(), 1.0)
+        return {**kwargs, "request_options": {**kwargs.get("request_options", {}), "timeout": restante}}
@@ -0,0 +1,113 @@
+"""
+Precarga especulativa de cuestionarios
+Mientras el estudiante responde un cuestionario se genera en segundo plano
+el siguiente, de modo que "otro cuestionario" se sirve al instante
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Any, Optional
+
+from temas import temas
+
+# Segundos que un cuestionario precargado sigue siendo válido
+TTL_PRECARGA = int(os.getenv('PRECARGA_TTL_SEGUNDOS', '900'))
+# Cuestionarios precargados por usuario y usuarios retenidos en memoria
+MAX_PRECARGAS_USUARIO = int(os.getenv('PRECARGA_MAX_POR_USUARIO', '2'))
+MAX_USUARIOS = int(os.getenv('PRECARGA_MAX_USUARIOS', '500'))
+# Hilos dedicados a generar en segundo plano
+MAX_HILOS_PRECARGA = int(os.getenv('PRECARGA_MAX_HILOS', '2'))
+# Precargar también el siguiente tema de la lista
+PRECARGAR_SIGUIENTE_TEMA = os.getenv('PRECARGA_SIGUIENTE_TEMA', '0') == '1'
+
+
+def siguiente_tema(tema: str, asignatura: str = "Estadística") -> Optional[str]:
+    """Devuelve el tema que sigue a `tema` en el temario, si existe"""
+    lista = temas.get(asignatura, [])
+    if tema in lista:
+        i = lista.index(tema)
+        if i + 1 < len(lista):
+            return lista[i + 1]
+    return None
+
+
+class PrecargadorCuestionarios:
+    def __init__(self, generar: Callable[[str, str, int], List[Dict[str, Any]]],
+                 ttl: Optional[int] = None, max_por_usuario: Optional[int] = None,
+                 max_usuarios: Optional[int] = None, max_hilos: Optional[int] = None):
+        """
+        Args:
+            generar: Función (tema, nivel_academico, cantidad) -> preguntas
+        """
+        self._generar = generar
+        self.ttl = TTL_PRECARGA if ttl is None else ttl
+        self.max_por_usuario = MAX_PRECARGAS_USUARIO if max_por_usuario is None else max_por_usuario
+        self.max_usuarios = MAX_USUARIOS if max_usuarios is None else max_usuarios
+        self._pool = ThreadPoolExecutor(
+            max_workers=MAX_HILOS_PRECARGA if max_hilos is None else max_hilos,
+            thread_name_prefix='precarga'
+        )
+        # user_id -> OrderedDict[(tema, nivel, cantidad) -> (expira, preguntas)]
+        self._slots = OrderedDict()
+        self._en_curso = set()
+        self._lock = threading.Lock()
+
+    def tomar(self, user_id: str, tema: str, nivel_academico: str, cantidad: int) -> Optional[List[Dict[str, Any]]]:
+        """Retira y devuelve el cuestionario precargado si existe y no expiró"""
+        clave = (tema, nivel_academico, cantidad)
+        with self._lock:
+            slots = self._slots.get(user_id)
+            if not slots or clave not in slots:
+                return None
+            expira, preguntas = slots.pop(clave)
+            if not slots:
+                del self._slots[user_id]
+        if expira < time.time():
+            return None
+        return preguntas
+
+    def programar(self, user_id: str, tema: str, nivel_academico: str, cantidad: int):
+        """Lanza en segundo plano la generación del próximo cuestionario"""
+        clave = (tema, nivel_academico, cantidad)
+        with self._lock:
+            slots = self._slots.get(user_id, {})
+            vigente = clave in slots and slots[clave][0] >= time.time()
+            if vigente or (user_id, clave) in self._en_curso:
+                return
+            self._en_curso.add((user_id, clave))
+        self._pool.submit(self._precargar, user_id, clave)
+
+    def programar_siguientes(self, user_id: str, tema: str, nivel_academico: str, cantidad: int):
+        """Precarga el mismo tema y, si está activado, el siguiente del temario"""
+        self.programar(user_id, tema, nivel_academico, cantidad)
+        if PRECARGAR_SIGUIENTE_TEMA:
+            siguiente = siguiente_tema(tema)
+            if siguiente:
+                self.programar(user_id, siguiente, nivel_academico, cantidad)
+
+    def _precargar(self, user_id: str, clave: tuple):
+        tema, nivel_academico, cantidad = clave
+        try:
+            preguntas = self._generar(tema, nivel_academico, cantidad)
+            if preguntas:
+                self._guardar(user_id, clave, preguntas)
+        except Exception as e:
+            print(f"Error precargando cuestionario de '{tema}': {e}")
+        finally:
+            with self._lock:
+                self._en_curso.discard((user_id, clave))
+
+    def _guardar(self, user_id: str, clave: tuple, preguntas: List[Dict[str, Any]]):
+        with self._lock:
+            slots = self._slots.setdefault(user_id, OrderedDict())
+            slots[clave] = (time.time() + self.ttl, preguntas)
+            slots.move_to_end(clave)
+            while len(slots) > self.max_por_usuario:
+                slots.popitem(last=False)
+
+            self._slots.move_to_end(user_id)
+            while len(self._slots) > self.max_usuarios:
+                self._slots.popitem(last=False)
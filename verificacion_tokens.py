@@ -0,0 +1,172 @@
+"""
+Verificación local de los ID tokens de Firebase Auth
+Comprueba firma, audiencia, emisor y expiración contra los certificados
+públicos de Google, que se descargan una vez y se refrescan según su
+Cache-Control; verificar un token no requiere ninguna llamada de red
+"""
+
+import base64
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from google.auth import jwt
+from requests.adapters import HTTPAdapter
+
+URL_CERTIFICADOS = (
+    "https://www.googleapis.com/robot/v1/metadata/x509/"
+    "securetoken@system.gserviceaccount.com"
+)
+# Segundos de vigencia de los certificados si la respuesta no trae max-age
+CERTIFICADOS_TTL = int(os.getenv('AUTH_CERTIFICADOS_TTL', '3600'))
+# Segundos mínimos entre descargas forzadas por un `kid` desconocido
+_ESPERA_MINIMA_REFRESCO = 60
+# Segundos antes del vencimiento en que se refrescan en segundo plano
+_MARGEN_REFRESCO = 300
+# Tolerancia de reloj al comprobar iat/exp
+_TOLERANCIA_RELOJ = 30
+_PATRON_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+# Sesión HTTP compartida para Identity Toolkit, Secure Token y los certificados
+sesion_http = requests.Session()
+sesion_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+class TokenInvalidoError(Exception):
+    """El token no es un ID token válido para este proyecto"""
+
+
+class TokenExpiradoError(TokenInvalidoError):
+    """El token es válido pero ya expiró (se puede renovar con el refresh token)"""
+
+
+class CertificadosNoDisponiblesError(Exception):
+    """No hay certificados para verificar (nunca se pudieron descargar)"""
+
+
+def _decodificar_segmento(segmento: str) -> Dict[str, Any]:
+    relleno = "=" * (-len(segmento) % 4)
+    return json.loads(base64.urlsafe_b64decode(segmento + relleno))
+
+
+class VerificadorTokens:
+    def __init__(self, project_id: str):
+        """
+        Args:
+            project_id: Proyecto de Firebase (audiencia de los tokens)
+        """
+        self.project_id = project_id
+        self.emisor = f"https://securetoken.google.com/{project_id}"
+        self._certificados: Dict[str, str] = {}
+        self._vencen = 0.0
+        self._ultima_descarga = 0.0
+        self._refrescando = False
+        self._lock = threading.Lock()
+        self._lock_descarga = threading.Lock()
+
+    def verificar(self, id_token: str) -> Dict[str, Any]:
+        """
+        Verifica un ID token y devuelve sus claims
+
+        Raises:
+            TokenExpiradoError: si el token expiró
+            TokenInvalidoError: si la firma, la audiencia o el emisor no son válidos
+            CertificadosNoDisponiblesError: si no se pudo descargar ningún certificado
+        """
+        try:
+            cabecera_b64, payload_b64, _ = id_token.split(".")
+            cabecera = _decodificar_segmento(cabecera_b64)
+            payload = _decodificar_segmento(payload_b64)
+        except (AttributeError, ValueError) as e:
+            raise TokenInvalidoError(f"Token mal formado: {e}")
+
+        if cabecera.get("alg") != "RS256":
+            raise TokenInvalidoError("Algoritmo de firma no permitido")
+        if payload.get("exp", 0) < time.time() - _TOLERANCIA_RELOJ:
+            raise TokenExpiradoError("El token expiró")
+
+        certificados = self._obtener_certificados(cabecera.get("kid"))
+        try:
+            claims = jwt.decode(
+                id_token,
+                certs=certificados,
+                audience=self.project_id,
+                clock_skew_in_seconds=_TOLERANCIA_RELOJ
+            )
+        except ValueError as e:
+            raise TokenInvalidoError(str(e))
+
+        if claims.get("iss") != self.emisor:
+            raise TokenInvalidoError("Emisor del token incorrecto")
+        if not claims.get("sub"):
+            raise TokenInvalidoError("El token no identifica a un usuario")
+        return claims
+
+    def _obtener_certificados(self, kid: Optional[str]) -> Dict[str, str]:
+        ahora = time.time()
+        with self._lock:
+            if kid in self._certificados:
+                if (ahora > self._vencen - _MARGEN_REFRESCO and not self._refrescando
+                        and ahora - self._ultima_descarga >= _ESPERA_MINIMA_REFRESCO):
+                    # Están por vencer (o vencidos): se sirven los actuales y se refrescan aparte
+                    self._refrescando = True
+                    threading.Thread(target=self._refrescar, daemon=True).start()
+                return self._certificados
+            if not self._hace_falta_descargar(kid, ahora):
+                return self._certificados
+
+        # La descarga va fuera de self._lock: las verificaciones con certificados
+        # conocidos no esperan a la red; solo un hilo descarga a la vez
+        with self._lock_descarga:
+            with self._lock:
+                # Otro hilo pudo descargarlos mientras se esperaba el turno
+                if not self._hace_falta_descargar(kid, time.time()):
+                    return self._certificados
+            try:
+                certificados, ttl = self._descargar()
+            except Exception as e:
+                with self._lock:
+                    if not self._certificados:
+                        raise CertificadosNoDisponiblesError(f"No se pudieron obtener los certificados: {e}")
+                    print(f"Error refrescando certificados de Firebase Auth: {e}")
+                    return self._certificados
+            with self._lock:
+                self._guardar(ahora, certificados, ttl)
+                return self._certificados
+
+    def _hace_falta_descargar(self, kid: Optional[str], ahora: float) -> bool:
+        """Sin certificados, o un kid desconocido (posible rotación de claves) fuera de la espera mínima"""
+        if not self._certificados:
+            return True
+        return kid not in self._certificados and ahora - self._ultima_descarga >= _ESPERA_MINIMA_REFRESCO
+
+    def _refrescar(self):
+        ahora = time.time()
+        try:
+            with self._lock_descarga:
+                certificados, ttl = self._descargar()
+            with self._lock:
+                self._guardar(ahora, certificados, ttl)
+        except Exception as e:
+            print(f"Error refrescando certificados de Firebase Auth: {e}")
+        finally:
+            with self._lock:
+                self._refrescando = False
+
+    def _descargar(self) -> Tuple[Dict[str, str], int]:
+        """Descarga los certificados y su vigencia según Cache-Control"""
+        with self._lock:
+            self._ultima_descarga = time.time()
+        resp = sesion_http.get(URL_CERTIFICADOS, timeout=10)
+        resp.raise_for_status()
+        coincidencia = _PATRON_MAX_AGE.search(resp.headers.get("Cache-Control", ""))
+        ttl = int(coincidencia.group(1)) if coincidencia else CERTIFICADOS_TTL
+        return resp.json(), ttl
+
+    def _guardar(self, ahora: float, certificados: Dict[str, str], ttl: int):
+        self._certificados = certificados
+        self._vencen = ahora + ttl